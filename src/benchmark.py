@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+"""
+This script benchmarks every stage of generating an instance and rendering
+its report on synthetic schedules of several sizes, and compares the results
+with a stored baseline
+"""
+
+import argparse
+import copy
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import utils_cap
+import utils_files
+import utils_flights
+import utils_sample
+import utils_stats
+import generate
+
+
+# Number of movements of the synthetic schedules
+SIZES = [10000, 50000, 150000, 300000]
+
+# Capacity profiles of parameters.yml giving 11 constraints (runway only)
+# and 24 constraints (6 runway and 6 terminal constraints per terminal)
+CAPACITY_PROFILES = {11: "D", 24: "A"}
+NUM_TERMINALS = 3
+
+# Every other profile is fixed so that cases only differ in size and
+# capacity
+PROFILES = {"daily_demand": "A", "proportion_linked": "C", "seats": "A",
+            "start_end_weeks": "A", "turn_times": "A", "weeklyfreq_a": "A",
+            "weeklyfreq_b": "A"}
+
+# Stages of generating an instance and its report, in order
+STAGES = ["sampling", "truncation", "demand_aggregation", "capacity",
+          "csv_export", "summary_stats", "report_rendering"]
+
+BATCH_SIZE = 4096
+SEED = 2022
+
+# Stored results of the default benchmark, to compare new results against
+BASELINE_FILE = os.path.join("benchmarks", "baseline.json")
+
+# Slowdowns below this many seconds are not regressions, as the timings of
+# the fastest stages are mostly noise
+MIN_TIME_INCREASE = 0.01
+
+
+def main():
+    """
+        Main function that runs the benchmark cases, writes the results to a
+        JSON file and compares them with the stored baseline, if found. Exits
+        with status 1 if any stage regressed beyond the threshold
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES,
+                        help="numbers of movements of the schedules")
+    parser.add_argument("--constraints", type=int, nargs="+",
+                        default=list(CAPACITY_PROFILES),
+                        choices=list(CAPACITY_PROFILES),
+                        help="numbers of capacity constraints")
+    parser.add_argument("--stages", nargs="+", default=STAGES,
+                        choices=STAGES, help="stages to benchmark")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="number of timed runs of each stage, the "
+                             "fastest one is reported")
+    parser.add_argument("--output", default="benchmark.json",
+                        help="JSON file to write the results to")
+    parser.add_argument("--baseline", default=BASELINE_FILE,
+                        help="JSON file with results to compare against "
+                             "(skipped if it does not exist)")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="relative increase in time or peak memory "
+                             "over the baseline counted as a regression")
+    args = parser.parse_args()
+
+    # Read first, so that refreshing the baseline compares with the old one
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as infile:
+            baseline = json.load(infile)
+    else:
+        print(f"No baseline found at {args.baseline}, results will not be "
+              "compared")
+
+    params = generate.load_parameters()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for num_constraints in args.constraints:
+            for size in args.sizes:
+                name = f"{size // 1000}k_{num_constraints}c"
+                print(name)
+
+                for stage, timing, peak in run_case(
+                        params, size, num_constraints, args.stages,
+                        args.repeat, tmp_dir):
+                    print(f" - {stage}: {timing:.4f}s, "
+                          f"{peak / 2 ** 20:.1f} MiB")
+                    results.append({"case": name, "movements": size,
+                                    "constraints": num_constraints,
+                                    "stage": stage, "time": timing,
+                                    "peak_memory": peak})
+
+    output = {"python": sys.version.split()[0], "numpy": np.__version__,
+              "platform": platform.platform(), "repeat": args.repeat,
+              "results": results}
+
+    with open(args.output, "w") as outfile:
+        json.dump(output, outfile, indent=2)
+    print(f"Results written to {args.output}")
+
+    if baseline is not None:
+        regressions = compare_results(baseline, output, args.threshold)
+        if regressions:
+            sys.exit(1)
+
+
+def get_case_params(params, size, num_constraints):
+    """
+        Instance parameters of a benchmark case, as chosen by
+        utils_sample.choose_profiles but with fixed profiles, domestic share,
+        total demand and terminals
+    """
+    profiles = dict(PROFILES, capacity=CAPACITY_PROFILES[num_constraints])
+
+    case_params = {key: copy.deepcopy(value[profiles[key]])
+                   if key in profiles else copy.deepcopy(value)
+                   for key, value in params.items() if key != "samplers"}
+    case_params["profiles"] = profiles
+    case_params["samplers"] = utils_sample.select_samplers(
+        params["samplers"], profiles)
+
+    case_params["dom_req"] = (params["dom_req"]["min_p"] +
+                              params["dom_req"]["max_p"]) / 2
+    case_params["total_demand"] = size
+    case_params["Terminals"] = [f"Term{i + 1}" for i in range(NUM_TERMINALS)]
+
+    return case_params
+
+
+def measure(func, repeat):
+    """
+        Run func once untimed (so that lazy imports and first-call costs are
+        not counted), then repeat times and return the fastest running time
+        and the peak memory allocated during one more traced run
+    """
+    func()
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return min(timings), peak
+
+
+def run_case(params, size, num_constraints, stages, repeat, tmp_dir):
+    """
+        Run the stages of a benchmark case in order, each on the output of
+        the previous ones, up to the last selected stage. Every stage draws
+        from its own generator seeded with SEED, so all runs of a stage do
+        the same work. Yields the name, time in seconds and peak memory in
+        bytes of each selected stage
+    """
+    case_params = get_case_params(params, size, num_constraints)
+    dem_path = os.path.join(tmp_dir, "demand.csv")
+    cap_path = os.path.join(tmp_dir, "capacity.csv")
+    state = dict()
+
+    def sampling():
+        rng = np.random.default_rng(SEED)
+        samplers = utils_sample.compile_samplers(case_params)
+        batch = generate.sample_series_until_demand(
+            case_params, samplers, BATCH_SIZE, rng)
+        state["schedule"] = generate.batch_to_schedule(batch, case_params)
+
+    def truncation():
+        rng = np.random.default_rng(SEED)
+        state["trunc_schedule"], _ = generate.truncate_schedule(
+            state["schedule"], case_params, rng)
+
+    def to_dataframe():
+        # Not part of any stage, run once after truncation
+        state["dem_df"] = state["trunc_schedule"].to_dataframe()
+        terminals = np.unique(state["dem_df"]["Term"]).tolist()
+        state["cap_lims"] = generate.init_cap_lims(case_params, terminals)
+
+    def demand_aggregation():
+        window_lookups = utils_cap.get_window_lookups(state["cap_lims"])
+        state["demand"], _ = utils_flights.get_demand_tensor(
+            state["dem_df"], state["cap_lims"], window_lookups)
+
+    def capacity():
+        rng = np.random.default_rng(SEED)
+        cap_lims = copy.deepcopy(state["cap_lims"])
+        generate.set_cap_limits(dict(case_params), cap_lims,
+                                state["demand"], rng)
+        state["cap_df"] = utils_cap.cap_lims_to_df(cap_lims)
+
+    def csv_export():
+        generate.export_schedule(state["dem_df"]).to_csv(dem_path, index=None)
+        state["cap_df"].to_csv(cap_path, index=None)
+
+    def summary_stats():
+        # Reports are built from the exported files
+        report_df, _ = utils_files.read_schedule(dem_path)
+        cap_df, _ = utils_files.read_table(cap_path)
+        state["report_cap_lims"] = utils_cap.df_to_cap_lims(cap_df)
+        state["stats"] = utils_stats.get_summary_stats(report_df)
+
+    def report_rendering():
+        # Only needed here, so that other stages run without matplotlib
+        import visualise
+        visualise.import_pyplot()
+        from matplotlib.backends.backend_pdf import PdfPages
+
+        with PdfPages(io.BytesIO()) as pdf:
+            visualise.visualise_summary_stats(state["stats"], pdf)
+            visualise.visualise_demand_vs_capacity(
+                state["demand"], state["report_cap_lims"], pdf)
+
+    functions = [sampling, truncation, demand_aggregation, capacity,
+                 csv_export, summary_stats, report_rendering]
+    # Untimed steps run after a stage, before the next one
+    after = {"truncation": to_dataframe}
+    last_stage = max(STAGES.index(stage) for stage in stages)
+
+    for stage, func in zip(STAGES[:last_stage + 1], functions):
+        if stage in stages:
+            timing, peak = measure(func, repeat)
+            yield stage, timing, peak
+        else:
+            func()
+
+        if stage in after:
+            after[stage]()
+
+    assert "cap_lims" not in state or len(state["cap_lims"]) == num_constraints
+
+
+def compare_results(baseline, output, threshold):
+    """
+        Print the change in time and peak memory of every stage also found in
+        the baseline. Returns the list of (case, stage) that got slower or
+        used more memory by more than threshold (relative), ignoring
+        slowdowns below MIN_TIME_INCREASE
+    """
+    baseline_results = {(r["case"], r["stage"]): r
+                        for r in baseline["results"]}
+    regressions = []
+
+    print(f"\nComparison with baseline (threshold {threshold:.0%})")
+    for result in output["results"]:
+        key = (result["case"], result["stage"])
+        if key not in baseline_results:
+            continue
+
+        old = baseline_results[key]
+        time_ratio = result["time"] / max(old["time"], 1e-9)
+        memory_ratio = result["peak_memory"] / max(old["peak_memory"], 1)
+
+        is_regression = memory_ratio > 1 + threshold or (
+            time_ratio > 1 + threshold and
+            result["time"] - old["time"] > MIN_TIME_INCREASE)
+        if is_regression:
+            regressions.append(key)
+
+        flag = " REGRESSION" if is_regression else ""
+        print(f" - {key[0]} {key[1]}: time x{time_ratio:.2f}, "
+              f"peak memory x{memory_ratio:.2f}{flag}")
+
+    print(f"{len(regressions)} regressions")
+
+    return regressions
+
+
+if __name__ == "__main__":
+    main()
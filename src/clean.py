@@ -1,18 +1,35 @@
 #!/usr/bin/env python
 """
-This script cleans output files in capacity, demand, metadata and reports
-folders
+This script cleans output files in capacity, demand, metadata, reports and
+profiles folders
 """
 
+import argparse
 import os
 
 
 def main():
     """
-        Clean output files (demand, capacity, metadata and reports)
+        Main function that cleans all output files
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_arguments(parser)
+    run(parser.parse_args())
+
+
+def add_arguments(parser):
+    """
+        Add the arguments of this script to an argparse parser (none)
+    """
+
+
+def run(args):
+    """
+        Clean output files (demand, capacity, metadata, reports and profiles)
     """
     # Get schedule files
-    for folder in ["demand", "capacity", "reports", "metadata"]:
+    for folder in ["demand", "capacity", "reports", "metadata",
+                   os.path.join("reports", "cache"), "profiles", "cache"]:
         dirpath = os.path.join(os.getcwd(), "schedules", folder)
 
         if not os.path.exists(dirpath):
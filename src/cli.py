@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+"""
+This script is a single entry point for generating instances, creating their
+reports, summarising and cleaning them, with one subcommand for each
+"""
+
+import argparse
+import importlib
+import sys
+
+
+# Subcommands, with the script run by each one and its help. Scripts are only
+# imported when their subcommand is run, so that e.g. cleaning does not wait
+# for numpy, pandas or matplotlib to be imported
+COMMANDS = {
+    "generate": ("generate", "generate synthetic instances"),
+    "report": ("visualise", "create a PDF report of each instance"),
+    "summary": ("summarise", "summarise all instances in a single table"),
+    "clean": ("clean", "delete all generated files"),
+}
+
+
+def main(argv=None):
+    """
+        Main function that runs the subcommand given in the arguments
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="command", required=True,
+                                       metavar="COMMAND")
+
+    module = None
+    for command, (script, help_) in COMMANDS.items():
+        subparser = subparsers.add_parser(command, help=help_,
+                                          description=help_)
+
+        # Only the arguments of the subcommand being run are needed
+        if argv[:1] == [command]:
+            module = importlib.import_module(script)
+            module.add_arguments(subparser)
+            command_parser = subparser
+
+    args = parser.parse_args(argv)
+
+    # Scripts may check that their arguments go together, as their main does
+    if hasattr(module, "check_arguments"):
+        module.check_arguments(command_parser, args)
+    module.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,27 +5,31 @@ N is an integer provided by the user as an argument when calling the script
 """
 
 
-import datetime
+import argparse
+import contextlib
+import multiprocessing
 import os
-import sys
-import yaml
+import time
 import numpy as np
-import pandas as pd
 import utils_dates
 import utils_times
 import utils_flights
 import utils_sample
 import utils_cap
 import utils_files
-
-
-np.random.seed(seed=42)
+import utils_instrument
+import utils_params
+import utils_profile
+import utils_schedule
 
 # Create start and end date
-SEASON_START = datetime.datetime(2020, 3, 29)
-SEASON_END = datetime.datetime(2020, 10, 24)
-FIRST_WEEK = SEASON_START.isocalendar()[1] - (SEASON_START.isoweekday() < 1)
-LAST_WEEK = SEASON_END.isocalendar()[1] - (SEASON_END.isoweekday() < 1)
+SEASON_START = utils_dates.SEASON_START
+SEASON_END = utils_dates.SEASON_END
+FIRST_WEEK = utils_dates.FIRST_WEEK
+LAST_WEEK = utils_dates.LAST_WEEK
+
+# Block size used in horizon-first mode if no batch size is given
+HORIZON_FIRST_BATCH_SIZE = 1024
 
 
 def main():
@@ -33,177 +37,544 @@ def main():
     Main function to generate synthetic data
     """
 
-    # Number of schedules to generate
-    if len(sys.argv) == 1:
-        num_schedules = 50
-    else:
-        num_schedules = int(sys.argv[1])
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_arguments(parser)
+    args = parser.parse_args()
+    check_arguments(parser, args)
+    run(args)
 
-    with open("parameters.yml") as stream:
-        try:
-            params = yaml.safe_load(stream)
-        except yaml.YAMLError as exc:
-            print(exc)
 
-    for j in range(num_schedules):
-        print(f"\nSchedule {j}")
-        # Choose profiles
-        schedule_params = utils_sample.choose_profiles(params)
+def add_arguments(parser):
+    """
+        Add the arguments of this script to an argparse parser
+    """
+    parser.add_argument("num_schedules", nargs="?", type=int, default=50,
+                        help="number of schedules to generate")
+    parser.add_argument("--batch-size", type=int, default=None,
+                        help="sample series in blocks of this size instead "
+                             "of one at a time")
+    parser.add_argument("--horizon-first", action="store_true",
+                        help="sample the number of days first and reach the "
+                             "total demand within it (sampled in blocks, see "
+                             "--batch-size)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes generating instances")
+    parser.add_argument("--format", default="csv",
+                        choices=list(utils_files.TABLE_FORMATS),
+                        help="file format of demand and capacity tables")
+    parser.add_argument("--seed", type=int, default=42,
+                        help="root seed from which every instance seed is "
+                             "derived")
+    parser.add_argument("--instrument", metavar="FILE",
+                        help="write the time and memory used by each stage "
+                             "of every instance to FILE, as JSON lines")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="also record the peak memory allocated by each "
+                             "stage with tracemalloc (slower, needs "
+                             "--instrument)")
+    profile = parser.add_mutually_exclusive_group()
+    profile.add_argument("--profile", type=int, nargs="?", const=1, default=0,
+                         metavar="K",
+                         help="profile the first K instances (1 if K is not "
+                              "given), writing pstats and collapsed stacks to "
+                              f"{utils_profile.PROFILES_DIR}")
+    profile.add_argument("--profile-instances", nargs="+", metavar="I",
+                         help="generate and profile only these instances, "
+                              "e.g. I0003 or 3, exactly as they are generated "
+                              "in a full run with the same seed")
+
+
+def check_arguments(parser, args):
+    """
+        Exit with a usage error if the parsed arguments do not go together
+    """
+    if args.trace_memory and args.instrument is None:
+        parser.error("--trace-memory requires --instrument")
 
-        # Generate schedule
-        dem_dict, schedule_params = generate_schedule(schedule_params)
+    for instance in args.profile_instances or []:
+        instance_id = utils_files.get_instance_id(instance)
+        if not (instance_id[:1] == "I" and instance_id[1:].isdigit()):
+            parser.error(f"invalid instance ID '{instance}'")
 
-        dem_df = pd.DataFrame(dem_dict)
 
-        filename = "I" + str(j).zfill(4) + "_demand.csv"
-        print(f" - {filename}")
+def run(args):
+    """
+        Generate synthetic data as requested by the parsed arguments
+    """
+    num_schedules = args.num_schedules
+
+    params = load_parameters()
+
+    folders = ["demand", "capacity"]
+    if args.format == "csv":
+        folders.append("metadata")
 
-        filedir = os.path.join('schedules', 'demand')
+    for folder in folders:
+        filedir = os.path.join('schedules', folder)
         is_exist = os.path.exists(filedir)
         if not is_exist:
             # Create a new directory because it does not exist
             os.makedirs(filedir)
             print(f"New directory {filedir} created")
 
-        filepath = os.path.join(filedir, filename)
-        dem_df.to_csv(filepath, index=None)
+    instances = range(num_schedules)
+    profiled = range(args.profile)
+    if args.profile_instances:
+        instances = profiled = sorted(
+            {int(utils_files.get_instance_id(instance)[1:])
+             for instance in args.profile_instances})
+
+    # Instance j always gets the j-th child seed, so its output does not
+    # depend on the number of workers, the order in which they finish or
+    # which other instances are generated
+    seed_seqs = np.random.SeedSequence(args.seed).spawn(
+        max(instances, default=-1) + 1)
+    instrument = None
+    if args.instrument is not None:
+        instrument = "memory" if args.trace_memory else "time"
+
+    tasks = [(j, seed_seqs[j], params, args.batch_size, args.format,
+              args.horizon_first, instrument, j in profiled)
+             for j in instances]
+
+    with contextlib.ExitStack() as stack:
+        outfile = None
+        if args.instrument is not None:
+            outfile = stack.enter_context(open(args.instrument, "w"))
+
+        if args.workers > 1:
+            pool = stack.enter_context(multiprocessing.Pool(args.workers))
+            records = pool.imap_unordered(generate_instance_from_task, tasks)
+        else:
+            records = map(generate_instance_from_task, tasks)
+
+        for record in records:
+            if outfile is not None:
+                utils_instrument.write_record(record, outfile)
+
+
+def load_parameters(path="parameters.yml",
+                    cache_dir=utils_params.PARAMS_CACHE_DIR):
+    """
+        Load the distributions of all parameters from a YAML file, validated
+        and compiled (see utils_params.load_parameters). Use cache_dir=None
+        to compile them in memory without reading or writing the cache
+    """
+    return utils_params.load_parameters(path, cache_dir)
+
+
+def iter_instances(params, seeds, batch_size=None, horizon_first=False):
+    """
+        Generate one instance per seed, lazily and in memory, from parameters
+        loaded once with load_parameters. A seed can be an int or a
+        np.random.SeedSequence (e.g. spawned from a root seed as in main, so
+        that instance j matches IXXXX files generated with the same root
+        seed). Yields tuples (demand table, capacity table, metadata) with
+        the demand table as built by build_instance
+    """
+    for seed in seeds:
+        yield build_instance(seed, params, batch_size=batch_size,
+                             horizon_first=horizon_first)
+
+
+def build_instance(seed, params, batch_size=None, horizon_first=False):
+    """
+        Generate an instance with its own random generator, without writing
+        anything to disk. Returns the schedule as a typed DataFrame (dates as
+        day offsets from the start of the season, see export_schedule for the
+        exported form), the capacity table and the metadata of the instance
+    """
+    rng = np.random.default_rng(seed)
+
+    # Choose profiles
+    with utils_instrument.stage("choose_profiles"):
+        schedule_params = utils_sample.choose_profiles(params, rng)
+
+    # Generate schedule
+    with utils_instrument.stage("generate_schedule"):
+        schedule, schedule_params = generate_schedule(
+            schedule_params, rng, batch_size=batch_size,
+            horizon_first=horizon_first)
+
+    dem_df = schedule.to_dataframe()
 
-        cap_lims, schedule_params = generate_cap_output(schedule_params, dem_df)
+    with utils_instrument.stage("generate_cap_output"):
+        cap_lims, schedule_params = generate_cap_output(
+            schedule_params, dem_df, rng)
         cap_df = utils_cap.cap_lims_to_df(cap_lims)
 
-        # Export capacity file
-        filename = "I" + str(j).zfill(4) + "_capacity.csv"
-        filedir = os.path.join('schedules', 'capacity')
-        is_exist = os.path.exists(filedir)
-        if not is_exist:
-            # Create a new directory because it does not exist
-            os.makedirs(filedir)
-            print(f"New directory {filedir} created")
+    # Compiled samplers are not part of the metadata of the instance
+    schedule_params.pop("samplers", None)
 
-        filepath = os.path.join(filedir, filename)
-        cap_df.to_csv(filepath, index=None)
+    return dem_df, cap_df, schedule_params
 
-        # Export metadata
-        filename = "I" + str(j).zfill(4) + "_metadata.yml"
-        filedir = os.path.join('schedules', 'metadata')
-        is_exist = os.path.exists(filedir)
-        if not is_exist:
-            # Create a new directory because it does not exist
-            os.makedirs(filedir)
-            print(f"New directory {filedir} created")
 
-        filepath = os.path.join(filedir, filename)
-        with utils_files.safe_open(filepath) as outfile:
+def generate_instance_from_task(task):
+    """
+        Unpack a task tuple and generate that instance (used by the pool),
+        profiling it if the last element of the task is True
+    """
+    *args, profile = task
+    if profile:
+        name = "I" + str(args[0]).zfill(4) + "_generate"
+        return utils_profile.profile_call(name, generate_instance, *args)
+
+    return generate_instance(*args)
+
+
+def generate_instance(j, seed_seq, params, batch_size=None,
+                      table_format="csv", horizon_first=False,
+                      instrument=None):
+    """
+        Generate instance j with its own random generator and export demand,
+        capacity and metadata files. With table_format "parquet" or "feather"
+        the tables keep their types and the metadata is stored inside the
+        demand file instead of a separate YAML file. If instrument is "time"
+        or "memory", returns a record of the instance with the measurements
+        of each stage (see utils_instrument.Recorder), None otherwise
+    """
+    if instrument is None:
+        export_instance(j, seed_seq, params, batch_size, table_format,
+                        horizon_first)
+        return None
+
+    start = time.perf_counter()
+    with utils_instrument.recording(trace_memory=instrument == "memory") \
+            as recorder:
+        dem_df, cap_df, schedule_params = export_instance(
+            j, seed_seq, params, batch_size, table_format, horizon_first)
+
+    return {
+        "instance": "I" + str(j).zfill(4),
+        "time": time.perf_counter() - start,
+        "profiles": schedule_params["profiles"],
+        "total_demand": int(schedule_params["total_demand"]),
+        "terminals": len(schedule_params["Terminals"]),
+        "series": len(dem_df),
+        "movements": int(dem_df["NoOps"].sum()),
+        "constraints": len(schedule_params["capacity"]),
+        "stages": recorder.stages,
+    }
+
+
+def export_instance(j, seed_seq, params, batch_size, table_format,
+                    horizon_first):
+    """
+        Generate instance j and export its files (see generate_instance).
+        Returns the demand table, capacity table and metadata
+    """
+    print(f"\nSchedule {j}")
+    extension = utils_files.TABLE_FORMATS[table_format]
+
+    dem_df, cap_df, schedule_params = build_instance(
+        seed_seq, params, batch_size=batch_size, horizon_first=horizon_first)
+
+    # Export demand file
+    filename = "I" + str(j).zfill(4) + "_demand" + extension
+    print(f" - {filename}")
+
+    filepath = os.path.join('schedules', 'demand', filename)
+    with utils_instrument.stage("export_demand"):
+        if table_format == "csv":
+            utils_files.write_table(export_schedule(dem_df), filepath)
+        else:
+            utils_files.write_table(export_schedule(dem_df, typed=True),
+                                    filepath, metadata=schedule_params)
+
+    # Export capacity file
+    filename = "I" + str(j).zfill(4) + "_capacity" + extension
+    filepath = os.path.join('schedules', 'capacity', filename)
+    with utils_instrument.stage("export_capacity"):
+        if table_format == "csv":
+            utils_files.write_table(cap_df, filepath)
+        else:
+            utils_files.write_table(cap_df.astype(
+                {"Resource": "category", "ArrDep": "category",
+                 "DomInt": "category", "Terminal": "category"}), filepath)
+
+    # Export metadata
+    if table_format == "csv":
+        import yaml
+
+        filename = "I" + str(j).zfill(4) + "_metadata.yml"
+        filepath = os.path.join('schedules', 'metadata', filename)
+        with utils_instrument.stage("export_metadata"), \
+                utils_files.safe_open(filepath) as outfile:
             yaml.dump(schedule_params, outfile, default_flow_style=False)
 
+    return dem_df, cap_df, schedule_params
 
-def generate_schedule(params):
+
+def export_schedule(schedule_df, typed=False):
+    """
+        Copy of the schedule with dates, times and flight numbers formatted as
+        strings for exporting. If typed is True, dates are converted to
+        datetimes, missing turnaround flight numbers to nulls and every other
+        column keeps its type
     """
-        Generate a single schedule using distributions given in params
+    turn_fl_nums = schedule_df["TurnFlNum"].values
+
+    if typed:
+        return schedule_df.assign(
+            StartDate=utils_dates.days_to_datetime64(schedule_df["StartDate"]),
+            EndDate=utils_dates.days_to_datetime64(schedule_df["EndDate"]),
+            TurnFlNum=schedule_df["TurnFlNum"].astype("Int32").mask(
+                turn_fl_nums < 0))
+
+    return schedule_df.assign(
+        StartDate=utils_dates.days_to_strs(schedule_df["StartDate"]),
+        EndDate=utils_dates.days_to_strs(schedule_df["EndDate"]),
+        Req=np.char.zfill(schedule_df["Req"].values.astype(str), 4),
+        TurnFlNum=np.where(
+            turn_fl_nums >= 0,
+            np.char.zfill(turn_fl_nums.astype(str), 5), ""),
+        FlNum=np.char.zfill(schedule_df["FlNum"].values.astype(str), 5))
+
+
+def generate_schedule(params, rng, batch_size=None, horizon_first=False):
+    """
+        Generate a single schedule using distributions given in params. If
+        batch_size is given, series are sampled in blocks of that size. If
+        horizon_first is True, the number of days is sampled before the series
+        and the total demand is reached within it
     """
     # Generate total demand
-    total_demand = utils_sample.sample_total_demand(params)
+    total_demand = utils_sample.sample_total_demand(params, rng)
     params["total_demand"] = total_demand
 
     n_terminals = int(np.ceil(total_demand / 80000))
     params["Terminals"] = [f"Term{i + 1}" for i in range(n_terminals)]
 
+    if horizon_first:
+        return generate_schedule_horizon_first(
+            params, batch_size or HORIZON_FIRST_BATCH_SIZE, rng), params
+
+    if batch_size is not None:
+        return generate_schedule_batched(params, batch_size, rng), params
+
     # Initialise number of flights to 0
     flight_requests = 0
     slot_requests = 0
 
     # Generate flights
-    flight_list = []
+    schedule = utils_schedule.Schedule(params["Terminals"])
 
     while True:
         # Generate flight
-        flight = generate_single_request(params)
+        flight = generate_single_request(params, rng)
 
         # Assign id and update number of requests created
-        flight["FlNum"] = str(slot_requests).zfill(5)
+        flight["FlNum"] = slot_requests
         slot_requests += 1
         flight_requests += flight["NoOps"]
+        fl_idx = schedule.append(flight)
 
         # Check if turnaround flight needs to be created
-        is_linked = utils_sample.is_flight_linked(params)
+        is_linked = utils_sample.is_flight_linked(params, rng)
 
         if is_linked:
             # Generate turnaround flight
-            turn_fl = generate_turn_flight(flight, params)
+            turn_idx = generate_turn_flight(schedule, fl_idx, params, rng)
 
-            if turn_fl is not None:
+            if turn_idx is not None:
                 # Assign id and update number of requests created
-                turn_fl["FlNum"] = str(slot_requests).zfill(5)
+                schedule["FlNum"][turn_idx] = slot_requests
 
                 # Link flights
-                turn_fl["TurnCarrier"] = flight["Carrier"]
-                flight["TurnCarrier"] = turn_fl["Carrier"]
-                turn_fl["TurnFlNum"] = flight["FlNum"]
-                flight["TurnFlNum"] = turn_fl["FlNum"]
+                pair, swapped = [fl_idx, turn_idx], [turn_idx, fl_idx]
+                schedule["TurnCarrier"][pair] = schedule["Carrier"][swapped]
+                schedule["TurnFlNum"][pair] = schedule["FlNum"][swapped]
 
                 slot_requests += 1
                 flight_requests += flight["NoOps"]
-                flight_list.append(turn_fl)
-
-        flight_list.append(flight)
 
         # Stop when we reach total demand
         if flight_requests >= total_demand:
             break
 
     # Truncate schedule to adjust it to the chosen number of days
-    trunc_flight_list, trunc_demand = truncate_schedule(flight_list, params)
+    trunc_schedule, trunc_demand = truncate_schedule(schedule, params, rng)
     assert trunc_demand <= flight_requests
 
-    return trunc_flight_list, params
+    return trunc_schedule, params
 
 
-def truncate_schedule(flight_list, params):
-    num_days = utils_sample.sample_num_days(params)
+def generate_schedule_batched(params, batch_size, rng):
+    """
+        Sample series in blocks of batch_size until the cumulative number of
+        operations reaches the total demand, then truncate the schedule to the
+        chosen number of days. All fields are handled as column arrays
+    """
+    samplers = utils_sample.compile_samplers(params)
 
-    # Get last valid date
-    end_date = SEASON_START + datetime.timedelta(days=num_days - 1)
+    batch = sample_series_until_demand(params, samplers, batch_size, rng)
+    schedule = batch_to_schedule(batch, params)
 
-    trunc_flight_list = []
-    trunc_demand = 0
+    # Truncate schedule to adjust it to the chosen number of days
+    trunc_schedule, _ = truncate_schedule(schedule, params, rng)
 
-    for flight in flight_list:
-        flight_start_date = utils_dates.str_to_date(flight["StartDate"])
+    return trunc_schedule
 
-        # If this flight has some date included in the selected period
-        if flight_start_date <= end_date:
 
-            flight_end_date = utils_dates.str_to_date(flight["EndDate"])
-            if end_date < flight_end_date:
-                flight["EndDate"] = utils_dates.date_to_str(end_date)
+def generate_schedule_horizon_first(params, batch_size, rng):
+    """
+        Sample the number of days first and then series in blocks of
+        batch_size, with start weeks conditioned on starting within that
+        horizon and end dates clipped to it, until the number of operations
+        in the horizon reaches the total demand. Nothing is truncated
+        afterwards
+    """
+    num_days = utils_sample.sample_num_days(params, rng)
+    samplers = utils_sample.compile_samplers(
+        params, first_week=FIRST_WEEK, end_day=num_days - 1)
 
-                flight["NoOps"] = utils_flights.get_count_flights(
-                    flight["StartDate"], flight["EndDate"], flight["FREQ"])
+    batch = sample_series_until_demand(
+        params, samplers, batch_size, rng, end_day=num_days - 1)
 
-            trunc_flight_list.append(flight)
-            trunc_demand += flight["NoOps"]
+    return batch_to_schedule(batch, params)
 
-    return trunc_flight_list, trunc_demand
 
+def sample_series_until_demand(params, samplers, batch_size, rng,
+                               end_day=None):
+    """
+        Sample series in blocks of batch_size until the cumulative number of
+        operations (counting turnaround flights) reaches the total demand. If
+        end_day is given, series starting after it are discarded and the rest
+        end on that day at the latest. Returns a dictionary of arrays as
+        sampled by utils_sample.sample_series_batch, plus operation counts
+    """
+    total_demand = params["total_demand"]
+    num_weeks = LAST_WEEK - FIRST_WEEK - 1
 
-def generate_turn_flight(flight, parameters):
-    # Create copy of original flight
-    turn_fl = flight.copy()
+    # Generate flights
+    batches = []
+    flight_requests = 0
+
+    while flight_requests < total_demand:
+        batch = utils_sample.sample_series_batch(
+            params, samplers, batch_size, FIRST_WEEK, num_weeks, rng)
+
+        if end_day is not None:
+            is_valid = batch["start_days"] <= end_day
+            batch = {key: val[is_valid] for key, val in batch.items()}
+            np.minimum(batch["end_days"], end_day, out=batch["end_days"])
+
+        batch["no_ops"] = utils_dates.count_weekdays(
+            batch["start_days"], batch["end_days"], batch["weekday_masks"])
+        has_turn = batch["turn_minutes"] >= 0
+
+        # Keep series up to the one that reaches total demand
+        cum_requests = flight_requests + np.cumsum(
+            batch["no_ops"] * (1 + has_turn))
+        num_keep = min(
+            np.searchsorted(cum_requests, total_demand) + 1, len(has_turn))
 
-    # Assign unique id and update number of requests created
-    turn_fl["ArrDep"] = utils_flights.get_opposite_arr_dep(flight["ArrDep"])
-    turn_fl["Req"] = utils_sample.generate_turn_time(flight, parameters)
+        if num_keep == 0:
+            continue
 
-    if turn_fl["Req"] is None:
+        batches.append({key: val[:num_keep] for key, val in batch.items()})
+        flight_requests = cum_requests[num_keep - 1]
+
+    return {key: np.concatenate([b[key] for b in batches])
+            for key in batches[0]}
+
+
+def batch_to_schedule(batch, params):
+    """
+        Build a schedule from sampled series, adding a turnaround flight right
+        after each series that has one
+    """
+    has_turn = batch["turn_minutes"] >= 0
+
+    # Assign ids, turnaround flights take the one following their series
+    fl_nums = np.cumsum(1 + has_turn) - (1 + has_turn)
+    turn_fl_nums = np.where(has_turn, fl_nums + 1, -1)
+
+    # Turnaround flights copy their series with opposite arrival/departure
+    rows = np.concatenate([np.arange(len(fl_nums)), np.flatnonzero(has_turn)])
+    is_turn = np.arange(len(rows)) >= len(fl_nums)
+
+    schedule = utils_schedule.Schedule(params["Terminals"], size=len(rows))
+    arr_dep = schedule.encode("ArrDep", batch["arr_dep"][rows])
+    carrier = schedule.codes["Carrier"]["ZZ"]
+
+    columns = dict()
+    columns["FREQ"] = (batch["weekday_masks"] @ (1 << np.arange(7)))[rows]
+    columns["Carrier"] = carrier
+    columns["Airport"] = schedule.codes["Airport"]["ZZ2"]
+    columns["Season"] = schedule.codes["Season"]["S20"]
+    columns["ServType"] = schedule.codes["ServType"]["J"]
+    columns["Term"] = schedule.encode("Term", batch["term"][rows])
+    columns["OrigDest"] = schedule.encode(
+        "OrigDest", np.where(batch["is_dom"], "ZZD", "ZZI")[rows])
+    columns["StartDate"] = batch["start_days"][rows]
+    columns["EndDate"] = batch["end_days"][rows]
+    columns["Seats"] = batch["seats"][rows]
+    columns["Pax"] = batch["pax"][rows]
+    columns["ArrDep"] = np.where(is_turn, 1 - arr_dep, arr_dep)
+    columns["Req"] = utils_times.minutes_to_hhmm(np.where(
+        is_turn, batch["turn_minutes"][rows], batch["minutes"][rows]))
+    columns["NoOps"] = batch["no_ops"][rows]
+    columns["TurnCarrier"] = np.where(has_turn, carrier, -1)[rows]
+    columns["TurnFlNum"] = np.where(
+        is_turn, fl_nums[rows], turn_fl_nums[rows])
+    columns["FlNum"] = np.where(is_turn, turn_fl_nums[rows], fl_nums[rows])
+    schedule.extend(columns)
+
+    return schedule
+
+
+@utils_instrument.stage("truncate_schedule")
+def truncate_schedule(schedule, params, rng):
+    """
+        Remove series starting after a sampled number of days and end the
+        remaining ones on that day at the latest
+    """
+    num_days = utils_sample.sample_num_days(params, rng)
+
+    # Get last valid day
+    end_day = num_days - 1
+
+    # Keep flights with some date included in the selected period
+    trunc_schedule = schedule.take(schedule["StartDate"] <= end_day)
+
+    np.minimum(trunc_schedule["EndDate"], end_day,
+               out=trunc_schedule["EndDate"])
+    trunc_schedule["NoOps"][:] = utils_dates.count_weekdays(
+        trunc_schedule["StartDate"], trunc_schedule["EndDate"],
+        trunc_schedule.weekday_masks())
+
+    return trunc_schedule, int(trunc_schedule["NoOps"].sum())
+
+
+def generate_turn_flight(schedule, idx, parameters, rng):
+    """
+        Add to the schedule the turnaround flight of the series in row idx: a
+        copy with opposite arrival/departure and a sampled requested time.
+        Returns the index of the new row, or None if no valid time was found
+    """
+    arr_dep = schedule.decode("ArrDep", schedule["ArrDep"][idx])
+    flight = {"ArrDep": arr_dep, "Req": schedule["Req"][idx]}
+
+    turn_req = utils_sample.generate_turn_time(flight, parameters, rng)
+
+    if turn_req is None:
         return None
 
-    return turn_fl
+    # Create copy of original flight
+    turn_idx = schedule.append_copy(idx)
 
+    turn_arr_dep = utils_flights.get_opposite_arr_dep(arr_dep)
+    schedule["ArrDep"][turn_idx] = schedule.codes["ArrDep"][turn_arr_dep]
+    schedule["Req"][turn_idx] = int(turn_req)
 
-def generate_single_request(parameters):
+    return turn_idx
+
+
+def generate_single_request(parameters, rng):
     flight = dict()
 
-    weekdays = utils_sample.sample_weekdays(parameters)
+    weekdays = utils_sample.sample_weekdays(parameters, rng)
     flight['FREQ'] = utils_dates.weekdays_to_freq_str(weekdays)
 
     # Populate unused fields
@@ -212,38 +583,38 @@ def generate_single_request(parameters):
     flight["Season"] = "S20"
     flight["ServType"] = "J"
 
-    flight["Term"] = utils_sample.sample_terminal(parameters)
+    flight["Term"] = utils_sample.sample_terminal(parameters, rng)
 
-    if utils_sample.is_flight_domestic(parameters):
+    if utils_sample.is_flight_domestic(parameters, rng):
         flight["OrigDest"] = "ZZD"
     else:
         flight["OrigDest"] = "ZZI"
 
     # Generate start and end week
     start_week, end_week = utils_sample.sample_start_end_week(
-        parameters, FIRST_WEEK)
+        parameters, FIRST_WEEK, rng)
 
     # Generate start and end dates
     start_date, end_date = utils_dates.week_limits_to_dates(
         start_week, end_week, weekdays, SEASON_START, SEASON_END,
         LAST_WEEK - FIRST_WEEK - 1)
-    flight["StartDate"] = utils_dates.date_to_str(start_date)
-    flight["EndDate"] = utils_dates.date_to_str(end_date)
+    flight["StartDate"] = utils_dates.date_to_day(start_date)
+    flight["EndDate"] = utils_dates.date_to_day(end_date)
 
     # Select number of seats
-    seats = utils_sample.sample_seats(parameters)
+    seats = utils_sample.sample_seats(parameters, rng)
     flight["Seats"] = seats
 
     # Select number of passengers
-    slf = utils_sample.sample_slf(parameters)
+    slf = utils_sample.sample_slf(parameters, rng)
     flight["Pax"] = int(flight["Seats"] * slf)
 
     # Select arrival or departure
-    arr_dep = np.random.choice(["A", "D"])
+    arr_dep = rng.choice(["A", "D"])
     flight["ArrDep"] = arr_dep
 
     # Select flight time
-    hour, min_ = utils_sample.sample_flight_time(parameters, arr_dep)
+    hour, min_ = utils_sample.sample_flight_time(parameters, arr_dep, rng)
     flight["Req"] = utils_times.time_to_str(hour, min_)
 
     # Get number of operations
@@ -256,43 +627,61 @@ def generate_single_request(parameters):
     return flight
 
 
-def generate_cap_output(parameters, schedule_df):
+def generate_cap_output(parameters, schedule_df, rng):
 
     terminals = np.unique(schedule_df["Term"]).tolist()
+    cap_lims = init_cap_lims(parameters, terminals)
+
+    # Get demand for each capacity limit
+    with utils_instrument.stage("demand"):
+        window_lookups = utils_cap.get_window_lookups(cap_lims)
+        demand, _ = utils_flights.get_demand_tensor(
+            schedule_df, cap_lims, window_lookups)
+
+    parameters = set_cap_limits(parameters, cap_lims, demand, rng)
+
+    return cap_lims, parameters
+
+
+def init_cap_lims(parameters, terminals):
+    """
+        Capacity limits (without limits yet) of the capacity profile in
+        parameters, repeating terminal constraints for every terminal
+    """
     cap_lims = []
 
-    # Define types of capacity restrictions
-    for elem in parameters["capacity"]:
-        times = [k * elem[4] for k in range(int(24 * 60 / elem[4]))]
+    # Define types of capacity restrictions (see utils_params.CAPACITY_FIELDS)
+    for spec in parameters["capacity"]:
+        num_windows = 24 * 60 // spec["Step"]
+
+        # If the resource is the runway, add one capacity constraint.
+        # Otherwise, repeat this capacity constraint for every terminal
+        spec_terminals = [""] if spec["Resource"] == "M" else terminals
 
-        # If the resource is the runway, add one capacity constraint
-        if elem[0] == "M":
+        for term in spec_terminals:
             cap_lims.append(
-                {"Resource": elem[0],
-                 "ArrDep": elem[1],
-                 "DomInt": elem[2],
-                 "Duration": elem[3],
+                {"Resource": spec["Resource"],
+                 "ArrDep": spec["ArrDep"],
+                 "DomInt": spec["DomInt"],
+                 "Duration": spec["Duration"],
+                 "Terminal": str(term),
+                 "Start": 0,
+                 "Step": spec["Step"],
+                 "Count": num_windows,
                  "Limit": None,
-                 "Terminal": "",
-                 "Time": times})
+                 "Runs": None})
 
-        else:
-            # Otherwise, repeat this capacity constraint for every terminal
-            for term in terminals:
-                cap_lims.append(
-                    {"Resource": elem[0],
-                     "ArrDep": elem[1],
-                     "DomInt": elem[2],
-                     "Duration": elem[3],
-                     "Limit": None,
-                     "Terminal": str(term),
-                     "Time": times})
+    return cap_lims
 
-    # Get demand for each capacity limit
-    demand = utils_flights.get_initial_demand(schedule_df, cap_lims)
 
+def set_cap_limits(parameters, cap_lims, demand, rng):
+    """
+        Set the limit of each capacity constraint to a random fraction of the
+        99th percentile of its demand (a demand tensor) and store the
+        constraints in parameters
+    """
     # Choose level of cap-dem imbalance
-    perc99s = utils_flights.get_percentile_demand(demand, 99)
+    perc99s = utils_flights.get_percentile_demand_tensor(demand, cap_lims, 99)
 
     # Reset capacity parameters and use extended information
     parameters["capacity"] = []
@@ -301,7 +690,7 @@ def generate_cap_output(parameters, schedule_df):
         min_q = parameters["capacity_ratios"]["min"]
         max_q = parameters["capacity_ratios"]["max"]
 
-        cap_lim["random_level"] = np.random.uniform(min_q, max_q)
+        cap_lim["random_level"] = rng.uniform(min_q, max_q)
         limit = int(np.ceil(perc99s[c_idx] * cap_lim["random_level"]))
 
         if cap_lim["Resource"] == 'M':
@@ -310,12 +699,13 @@ def generate_cap_output(parameters, schedule_df):
             assert cap_lim["Resource"] == 'P'
             limit = max(limit, 500)
 
-        cap_lim["Limit"] = (np.ones(len(cap_lim["Time"])) * limit).tolist()
+        cap_lim["Limit"] = [limit]
+        cap_lim["Runs"] = [cap_lim["Count"]]
 
         # Add to schedule parameters
         parameters["capacity"].append(cap_lim)
 
-    return cap_lims, parameters
+    return parameters
 
 
 if __name__ == "__main__":
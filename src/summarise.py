@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+"""
+This script builds a summary table of all generated instances found in the
+schedules folder, with one row per instance describing its demand, its
+capacity constraints and the profiles chosen to generate it
+"""
+
+import argparse
+import multiprocessing
+import os
+import numpy as np
+import pandas as pd
+import utils_cap
+import utils_files
+import utils_flights
+import utils_stats
+
+
+# Columns describing each instance, before profile and constraint columns
+INSTANCE_COLUMNS = ["Instance", "Signature", "Series", "Movements",
+                    "LinkedShare", "DomShare", "TotalDemand", "Constraints"]
+
+
+def main():
+    """
+        Main function that summarises every instance in a single table,
+        reusing the rows of instances whose files have not changed since the
+        table was last written
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_arguments(parser)
+    run(parser.parse_args())
+
+
+def add_arguments(parser):
+    """
+        Add the arguments of this script to an argparse parser
+    """
+    parser.add_argument("--output",
+                        default=os.path.join("schedules", "summary.csv"),
+                        help="summary table, written in the format given by "
+                             "its extension (.csv, .parquet or .feather)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes summarising instances")
+
+
+def run(args):
+    """
+        Write the summary table requested by the parsed arguments
+    """
+    dem_filenames, _ = utils_files.select_demand_files()
+
+    # Rows of the previous table, by instance
+    previous = dict()
+    if os.path.exists(args.output):
+        summary_df, _ = utils_files.read_table(args.output)
+        previous = {row["Instance"]: row
+                    for row in summary_df.to_dict("records")}
+
+    rows = []
+    tasks = []
+    for dem_file in dem_filenames:
+        instance = utils_files.get_instance(dem_file)
+        row = previous.get(instance)
+
+        if row is not None and row["Signature"] == get_signature(dem_file):
+            rows.append(row)
+        else:
+            tasks.append(dem_file)
+
+    print(f"{len(rows)} instances unchanged, {len(tasks)} to summarise")
+
+    if args.workers > 1:
+        with multiprocessing.Pool(args.workers) as pool:
+            rows.extend(pool.imap_unordered(summarise_instance, tasks,
+                                            chunksize=16))
+    else:
+        rows.extend(summarise_instance(dem_file) for dem_file in tasks)
+
+    summary_df = rows_to_df(rows)
+    utils_files.write_table(summary_df, args.output)
+    print(f"{len(summary_df)} instances summarised in {args.output}")
+
+
+def get_signature(dem_file):
+    """
+        Size and modification time of every file of an instance, which change
+        whenever the instance is generated again
+    """
+    paths = list(utils_files.get_input_paths(dem_file))
+    if os.path.exists(utils_files.get_metadata_path(dem_file)):
+        paths.append(utils_files.get_metadata_path(dem_file))
+
+    signature = []
+    for path in paths:
+        stat = os.stat(path)
+        signature.append(f"{stat.st_size}:{stat.st_mtime_ns}")
+
+    return ";".join(signature)
+
+
+def get_constraint_name(cap_lim):
+    """
+        Short name of a capacity constraint, e.g. R60/15/A/Dom for a runway
+        constraint on domestic arrivals with 60 minute windows starting every
+        15 minutes, followed by the terminal for terminal constraints
+    """
+    res = "T" if cap_lim["Resource"] == "P" else "R"
+    dom_int = {"D": "/Dom", "I": "/Int", "T": ""}[cap_lim["DomInt"]]
+    name = f"{res}{cap_lim['Duration']}/{cap_lim['Step']}/" + \
+        f"{cap_lim['ArrDep']}{dom_int}"
+
+    if cap_lim["Terminal"] != "":
+        name += "/" + cap_lim["Terminal"]
+
+    return name
+
+
+def summarise_instance(dem_file):
+    """
+        Summary row of the instance of a demand file, as a dictionary
+    """
+    dem_path, cap_path = utils_files.get_input_paths(dem_file)
+
+    dem_df, metadata = utils_files.read_schedule(dem_path)
+    if metadata is None:
+        metadata = utils_files.read_yaml(
+            utils_files.get_metadata_path(dem_file), default=dict())
+
+    cap_df, _ = utils_files.read_table(cap_path)
+    cap_lims = utils_cap.df_to_cap_lims(cap_df)
+
+    linked, _ = utils_stats.get_linked_split(dem_df)
+    dom, _ = utils_stats.get_dom_int_split(dem_df)
+
+    row = {
+        "Instance": utils_files.get_instance(dem_file),
+        "Signature": get_signature(dem_file),
+        "Series": len(dem_df),
+        "Movements": int(dem_df["NoOps"].sum()),
+        "LinkedShare": linked / max(len(dem_df), 1),
+        "DomShare": dom / max(len(dem_df), 1),
+        "TotalDemand": metadata.get("total_demand"),
+        "Constraints": len(cap_lims),
+    }
+
+    for key, profile in metadata.get("profiles", dict()).items():
+        row["Profile_" + key] = profile
+
+    # 99th percentile of demand and mean limit of each constraint
+    window_lookups = utils_cap.get_window_lookups(cap_lims)
+    demand, _ = utils_flights.get_demand_tensor(
+        dem_df, cap_lims, window_lookups)
+    perc99s = utils_flights.get_percentile_demand_tensor(demand, cap_lims, 99)
+
+    for c_idx, cap_lim in enumerate(cap_lims):
+        prefix = f"C{str(c_idx).zfill(2)}_"
+        row[prefix + "Name"] = get_constraint_name(cap_lim)
+        row[prefix + "P99Demand"] = float(perc99s[c_idx])
+        row[prefix + "Capacity"] = float(
+            np.mean(utils_cap.get_limits(cap_lim)))
+
+    return row
+
+
+def rows_to_df(rows):
+    """
+        Summary table from a list of rows, sorted by instance. Profile and
+        constraint columns follow the instance columns, missing values are
+        left empty
+    """
+    summary_df = pd.DataFrame(rows)
+    if summary_df.empty:
+        return pd.DataFrame(columns=INSTANCE_COLUMNS)
+
+    other_columns = sorted(set(summary_df.columns) - set(INSTANCE_COLUMNS))
+    summary_df = summary_df[INSTANCE_COLUMNS + other_columns]
+
+    return summary_df.sort_values("Instance").reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    main()
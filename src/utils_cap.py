@@ -3,72 +3,161 @@
 This script contains support functions for generate.py and visualise.py scripts
 """
 
-import pandas as pd
-import utils_times
+import numpy as np
 
 
-def cap_lims_to_df(cap_lims):
-    capacity_dicts = list()
+# Names of resources in capacity files and their codes in capacity limits
+RESOURCE_NAMES = {"M": "Runway", "P": "Terminal"}
+RESOURCE_CODES = {"Runway": "M", "Terminal": "P"}
 
-    for c_idx, cap_lim in enumerate(cap_lims):
-        for limit, time in zip(cap_lim["Limit"], cap_lim["Time"]):
-            assert cap_lim["Resource"] == 'P' or cap_lim["Resource"] == 'M'
 
-            resource = "Terminal" if cap_lim["Resource"] == 'P' else "Runway"
+def get_times(cap_lim):
+    """
+        Starting minute of each time window of a capacity limit. Windows start
+        at minute "Start" and are "Step" minutes apart, "Count" in total
+    """
+    return cap_lim["Start"] + cap_lim["Step"] * np.arange(cap_lim["Count"])
 
-            capacity_dicts.append({
-                "Constraint": c_idx,
-                "Resource": resource,
-                "ArrDep": cap_lim["ArrDep"],
-                "Duration": cap_lim["Duration"],
-                "Limit": int(limit),
-                "Time": int(utils_times.time_to_str(time // 60, time % 60)),
-                "DomInt": cap_lim["DomInt"],
-                "Terminal": cap_lim["Terminal"]
-            })
 
-            assert resource != "Runway" or cap_lim["Terminal"] == ""
+def get_limits(cap_lim):
+    """
+        Limit of each time window of a capacity limit, expanded from runs of
+        windows ("Runs" windows in a row sharing each value of "Limit")
+    """
+    return np.repeat(cap_lim["Limit"], cap_lim["Runs"])
 
-    capacity_df = pd.DataFrame(capacity_dicts)
 
-    return capacity_df
+def encode_runs(values, breaks):
+    """
+        Run-length encode an array, also starting a new run wherever breaks
+        is True. Returns the value and the length of each run
+    """
+    values = np.asarray(values)
+    if len(values) == 0:
+        return values, np.zeros(0, dtype=int)
 
+    starts = np.flatnonzero(np.r_[True, (values[1:] != values[:-1]) |
+                                  breaks[1:]])
+    lengths = np.diff(np.r_[starts, len(values)])
 
-def df_to_cap_lims(cap_df):
-    cap_lims = []
-    cap_dict = dict()
-    cap_dict["Constraint"] = ""
+    return values[starts], lengths
 
-    for _, row in cap_df.iterrows():
-        # If we are still exploring the same capacity limit
-        if row["Constraint"] == cap_dict["Constraint"]:
-            cap_dict["Limit"].append(row["Limit"])
 
-            hour, minute = utils_times.str_to_time(row["Time"])
-            cap_dict["Time"].append(hour * 60 + minute)
+def cap_lims_to_df(cap_lims):
+    """
+        Capacity file layout of a list of capacity limits, with one row per
+        time window of each capacity limit
+    """
+    for cap_lim in cap_lims:
+        assert cap_lim["Resource"] == 'P' or cap_lim["Resource"] == 'M'
+        assert cap_lim["Resource"] != "M" or cap_lim["Terminal"] == ""
+
+    import pandas as pd
+
+    counts = np.array([cap_lim["Count"] for cap_lim in cap_lims], dtype=int)
+    num_rows = counts.sum()
+
+    # Index of the constraint and of the time window within it for each row
+    constraints = np.repeat(np.arange(len(cap_lims)), counts)
+    windows = np.arange(num_rows) - np.repeat(np.cumsum(counts) - counts,
+                                              counts)
+
+    starts = np.array([cap_lim["Start"] for cap_lim in cap_lims], dtype=int)
+    steps = np.array([cap_lim["Step"] for cap_lim in cap_lims], dtype=int)
+    times = starts[constraints] + steps[constraints] * windows
+
+    limits = np.concatenate(
+        [get_limits(cap_lim) for cap_lim in cap_lims] + [[]]).astype(int)
+
+    def repeat_field(name, to_value=lambda value: value):
+        return np.repeat([to_value(cap_lim[name]) for cap_lim in cap_lims],
+                         counts)
+
+    capacity_df = pd.DataFrame({
+        "Constraint": constraints,
+        "Resource": repeat_field("Resource", RESOURCE_NAMES.get),
+        "ArrDep": repeat_field("ArrDep"),
+        "Duration": repeat_field("Duration"),
+        "Limit": limits,
+        "Time": times // 60 * 100 + times % 60,
+        "DomInt": repeat_field("DomInt"),
+        "Terminal": repeat_field("Terminal"),
+    })
 
-        # If we start a new capacity limit
-        else:
-            # Add previous one to list
-            if cap_dict["Constraint"] != "":
-                cap_lims.append(cap_dict.copy())
+    return capacity_df
 
-            # Restart the dictionary
-            cap_dict["Constraint"] = row["Constraint"]
 
-            assert row["Resource"] == "Runway" or row["Resource"] == "Terminal"
+def df_to_cap_lims(cap_df):
+    """
+        List of capacity limits from the capacity file layout, with the rows
+        of each constraint in consecutive, evenly spaced time windows
+    """
+    constraints = cap_df["Constraint"].values
+    is_first = np.r_[True, constraints[1:] != constraints[:-1]]
+    firsts = np.flatnonzero(is_first)
+    counts = np.diff(np.r_[firsts, len(constraints)])
+
+    hhmm = cap_df["Time"].values.astype(int)
+    times = hhmm // 100 * 60 + hhmm % 100
+
+    # Time windows of a constraint must be evenly spaced
+    window_steps = np.r_[np.diff(times), 0]
+    steps = np.where(counts > 1, window_steps[firsts], 24 * 60)
+    assert np.all(steps > 0)
+    assert np.all(np.repeat(steps, counts)[~is_first] ==
+                  window_steps[np.flatnonzero(~is_first) - 1])
+
+    # Runs of windows with the same limit, split by constraint
+    limits, runs = encode_runs(cap_df["Limit"].values.astype(int), is_first)
+    run_constraints = (np.cumsum(is_first) - 1)[np.cumsum(runs) - runs]
+    splits = np.cumsum(np.bincount(run_constraints,
+                                   minlength=len(firsts)))[:-1]
+    limits = np.split(limits, splits)
+    runs = np.split(runs, splits)
+
+    resources = cap_df["Resource"].values[firsts]
+    assert np.all(np.isin(resources, list(RESOURCE_CODES)))
+
+    # Missing terminals are read as NaN or None
+    terminals = [terminal if isinstance(terminal, str) else ""
+                 for terminal in cap_df["Terminal"].values[firsts]]
 
-            resource = "M" if row["Resource"] == "Runway" else "P"
-            cap_dict["Resource"] = resource
+    cap_lims = []
+    for c_idx, first in enumerate(firsts):
+        cap_lims.append({
+            "Resource": RESOURCE_CODES[resources[c_idx]],
+            "ArrDep": cap_df["ArrDep"].values[first],
+            "DomInt": cap_df["DomInt"].values[first],
+            "Duration": int(cap_df["Duration"].values[first]),
+            "Terminal": terminals[c_idx],
+            "Start": int(times[first]),
+            "Step": int(steps[c_idx]),
+            "Count": int(counts[c_idx]),
+            "Limit": limits[c_idx].tolist(),
+            "Runs": runs[c_idx].tolist()})
 
-            cap_dict["ArrDep"] = row["ArrDep"]
-            cap_dict["Duration"] = row["Duration"]
-            cap_dict["DomInt"] = row["DomInt"]
+    return cap_lims
 
-            terminal = "" if pd.isna(row["Terminal"]) else row["Terminal"]
-            cap_dict["Terminal"] = terminal
 
-            cap_dict["Limit"] = []
-            cap_dict["Time"] = []
+def get_window_lookup(cap_lim):
+    """
+        For every minute of the day, get the range of indices of the time
+        windows of a capacity constraint that cover that minute. Returns two
+        arrays with 1440 elements: first and last index (both included) of
+        the covering windows, with first > last if no window covers it
+    """
+    times = get_times(cap_lim)
+    minutes = np.arange(24 * 60)
 
-    return cap_lims
+    # First window ending at or after each minute, last one starting before
+    first_idx = np.searchsorted(times + cap_lim["Duration"] - 1, minutes)
+    last_idx = np.searchsorted(times, minutes, side="right") - 1
+
+    return first_idx, last_idx
+
+
+def get_window_lookups(cap_lims):
+    """
+        Get minute to time window lookup tables for all capacity constraints
+    """
+    return [get_window_lookup(cap_lim) for cap_lim in cap_lims]
@@ -7,6 +7,16 @@ import numpy as np
 import datetime
 
 
+# Dates are handled internally as integer day offsets from the start of the
+# season, and only formatted as strings when exporting
+SEASON_START = datetime.datetime(2020, 3, 29)
+SEASON_END = datetime.datetime(2020, 10, 24)
+
+# Weeks of the year of the first and last days of the season
+FIRST_WEEK = SEASON_START.isocalendar()[1] - (SEASON_START.isoweekday() < 1)
+LAST_WEEK = SEASON_END.isocalendar()[1] - (SEASON_END.isoweekday() < 1)
+
+
 def weekdays_to_freq_str(weekdays):
     wkd_nums = [weekname_to_num_mon_1_sun_7(d) for d in weekdays]
     out = ''.join([str(d) if d in wkd_nums else '0' for d in np.arange(1, 8)])
@@ -18,7 +28,7 @@ def freq_str_to_weekdays(freq_string):
     if isinstance(freq_string, (float, int)):
         freq_string = str(freq_string)
 
-    return np.array([int(d) for d in freq_string if d != '0'])
+    return np.array([int(d) for d in freq_string if d != '0'], dtype=int)
 
 
 def date_to_str(date):
@@ -29,6 +39,61 @@ def str_to_date(date_str):
     return datetime.datetime.strptime(date_str, "%d-%b-%y")
 
 
+def date_to_day(date):
+    """
+        Convert a date into a day offset from the start of the season
+    """
+    return (date - SEASON_START).days
+
+
+def day_to_date(day):
+    """
+        Convert a day offset from the start of the season into a date
+    """
+    return SEASON_START + datetime.timedelta(days=int(day))
+
+
+def day_to_weekday(day):
+    """
+        Weekday (0 for Monday) of a day offset, or array of day offsets, from
+        the start of the season
+    """
+    return (SEASON_START.weekday() + day) % 7
+
+
+def day_to_week(day):
+    """
+        Week number (weeks starting on Sunday, as in "%U") of a day offset, or
+        array of day offsets, counted from the week containing the start of
+        the season
+    """
+    return (day + (SEASON_START.weekday() + 1) % 7) // 7
+
+
+def strs_to_days(date_strs):
+    """
+        Convert an array of "%d-%b-%y" strings into day offsets from the start
+        of the season, parsing each distinct string only once
+    """
+    uniq_strs, inverse = np.unique(
+        np.asarray(date_strs).astype(str), return_inverse=True)
+    uniq_days = np.array([date_to_day(str_to_date(d)) for d in uniq_strs],
+                         dtype=int)
+
+    return uniq_days[inverse.ravel()]
+
+
+def days_to_strs(days):
+    """
+        Convert an array of day offsets from the start of the season into
+        "%d-%b-%y" strings, formatting each distinct day only once
+    """
+    uniq_days, inverse = np.unique(np.asarray(days), return_inverse=True)
+    uniq_strs = np.array([date_to_str(day_to_date(d)) for d in uniq_days])
+
+    return uniq_strs[inverse.ravel()]
+
+
 def weekname_to_num_mon_1_sun_7(day_str):
     weekday_dict = {
         "Mon": 1, "Tue": 2, "Wed": 3, "Thu": 4,
@@ -69,21 +134,84 @@ def select_dates(flight):
 
     """ For a given service (row), select all days between start and end data
         that match the days of the week given in the frequency field.
-        Return a list of all selected dates for each service."""
+        Return a list of all selected days (offsets from the start of the
+        season) for each service."""
 
-    dates = []
+    days = []
 
-    start_date = str_to_date(flight["StartDate"])
-    end_date = str_to_date(flight["EndDate"])
     flight_weekdays = freq_str_to_weekdays(flight["FREQ"])
 
-    for date in date_range(start_date, end_date):
-        date_weekday = datetime.datetime.weekday(date) + 1
+    for day in range(flight["StartDate"], flight["EndDate"] + 1):
+        if day_to_weekday(day) + 1 in flight_weekdays:
+            days.append(day)
+
+    return days
 
-        if date_weekday in flight_weekdays:
-            dates.append(date)
 
-    return dates
+def freqs_to_weekday_masks(freqs):
+    """
+        Convert an array of frequencies (strings or ints, e.g. "0030500") into
+        a (series x 7) boolean array of operating weekdays, Monday first,
+        parsing each distinct frequency only once
+    """
+    uniq_freqs, freq_inv = np.unique(
+        np.asarray(freqs).astype(str), return_inverse=True)
+
+    freq_masks = np.zeros((len(uniq_freqs), 7), dtype=bool)
+    for f_idx, freq in enumerate(uniq_freqs):
+        freq_masks[f_idx, freq_str_to_weekdays(freq) - 1] = True
+
+    return freq_masks[freq_inv.ravel()]
+
+
+def select_dates_matrix(start_days, end_days, freqs, first_day, num_days,
+                        packed=False):
+    """
+        For a whole schedule, build a (day x series) boolean matrix that is
+        True on every day (counted from first_day) on which a series operates.
+        freqs can be frequency strings or a (series x 7) boolean array of
+        operating weekdays. If packed is True, the series axis is packed into
+        bits (see np.packbits) to get a compact bitset
+    """
+    start_offsets = np.asarray(start_days) - first_day
+    end_offsets = np.asarray(end_days) - first_day
+
+    weekday_masks = np.asarray(freqs)
+    if weekday_masks.ndim == 1:
+        weekday_masks = freqs_to_weekday_masks(weekday_masks)
+
+    # Weekday (0 for Monday) of every day in the range
+    days = np.arange(num_days)
+    day_weekdays = day_to_weekday(first_day + days)
+
+    in_range = (start_offsets[None, :] <= days[:, None]) & \
+        (days[:, None] <= end_offsets[None, :])
+    dates_matrix = in_range & weekday_masks[:, day_weekdays].T
+
+    if packed:
+        return np.packbits(dates_matrix, axis=1)
+
+    return dates_matrix
+
+
+def days_to_datetime64(days):
+    """
+        Convert an array of day offsets from the start of the season into
+        numpy datetime64 dates
+    """
+    return np.datetime64(SEASON_START.date()) + np.asarray(days).astype(
+        "timedelta64[D]")
+
+
+def datetime64_to_days(dates):
+    """
+        Convert an array of numpy datetime64 dates into day offsets from the
+        start of the season
+    """
+    days = np.asarray(dates).astype("datetime64[D]") - \
+        np.datetime64(SEASON_START.date())
+
+    return days.astype(int)
 
 
 def week_limits_to_dates(start_week,
@@ -118,6 +246,63 @@ def week_limits_to_dates(start_week,
     return start_date, end_date
 
 
+def week_limits_to_days(start_weeks, end_weeks, weekday_masks, num_weeks):
+    """
+        Vectorised version of week_limits_to_dates for a season starting on a
+        Sunday. Takes arrays of start/end weeks relative to the first week of
+        the season and a (series x 7) boolean array of operating weekdays
+        (Monday first), and returns start/end dates as day offsets from the
+        start of the season
+    """
+    # Operating weekdays numbered from Sunday = 0
+    sun0_nums = np.roll(np.arange(7), -1)
+    first_day = np.where(weekday_masks, sun0_nums, 7).min(axis=1)
+    last_day = np.where(weekday_masks, sun0_nums, -1).max(axis=1)
+
+    start_days = np.asarray(start_weeks) * 7 + first_day
+    end_days = np.minimum(num_weeks, np.asarray(end_weeks)) * 7 + last_day
+
+    assert np.all(end_days >= start_days)
+
+    return start_days, end_days
+
+
+def count_weekdays(start_days, end_days, weekday_masks):
+    """
+        Count the days between start and end (both included) that fall on an
+        operating weekday, for arrays of day offsets and a (series x 7)
+        boolean array of operating weekdays (Monday first). Full weeks
+        contribute the number of operating weekdays, and only the remaining
+        days are checked
+    """
+    weekday_masks = np.asarray(weekday_masks, dtype=bool)
+    start_days = np.asarray(start_days)
+    num_days = np.asarray(end_days) - start_days + 1
+
+    counts = (num_days // 7) * weekday_masks.sum(axis=1)
+
+    remainder = num_days % 7
+    rows = np.arange(len(weekday_masks))
+    for day in range(6):
+        weekday = day_to_weekday(start_days + day)
+        counts += weekday_masks[rows, weekday] & (day < remainder)
+
+    return np.where(num_days > 0, counts, 0)
+
+
+def weekday_masks_to_freq_strs(weekday_masks):
+    """
+        Convert a (series x 7) boolean array of operating weekdays (Monday
+        first) into an array of frequency strings, e.g. "0030500"
+    """
+    bits = np.asarray(weekday_masks, dtype=int) @ (1 << np.arange(7))
+    freq_table = np.array([
+        ''.join(str(d + 1) if (b >> d) & 1 else '0' for d in range(7))
+        for b in range(128)])
+
+    return freq_table[bits]
+
+
 def get_wkday_zero_sunday(weekdays):
     """
     Take a list of weekdays in format 1-7 and convert sundays to zeros
@@ -141,9 +326,7 @@ def get_wkday_zero_sunday(weekdays):
 
 
 def get_first_last_dates(schedule_df):
-    all_starts = [str_to_date(d) for d in schedule_df["StartDate"]]
-    all_ends = [str_to_date(d) for d in schedule_df["EndDate"]]
-    first_date = np.min(all_starts)
-    last_date = np.max(all_ends)
+    first_day = int(np.min(schedule_df["StartDate"]))
+    last_day = int(np.max(schedule_df["EndDate"]))
 
-    return first_date, last_date
+    return first_day, last_day
@@ -5,6 +5,107 @@ This script contains support functions for generate.py and visualise.py scripts
 
 import os
 import errno
+import hashlib
+import numpy as np
+import utils_dates
+
+
+# Supported formats of demand and capacity tables and their file extensions
+TABLE_FORMATS = {"csv": ".csv", "parquet": ".parquet", "feather": ".feather"}
+
+# Key of the instance metadata in the file-level metadata of Arrow tables
+METADATA_KEY = b"instance_metadata"
+
+
+def is_file(filename, dir_):
+    """
+        Check whether an item in a directory is a file
+    """
+    filepath = os.path.join(dir_, filename)
+    if not os.path.isfile(filepath):
+        return False
+    if "DS_Store" in filename:
+        return False
+    return True
+
+
+def get_instance(dem_file):
+    """
+        Instance ID of a demand file, e.g. I0003 for I0003_demand.csv
+    """
+    instance = os.path.splitext(dem_file)[0]
+    return instance[:-len("_demand")]
+
+
+def get_instance_id(instance):
+    """
+        Instance ID from an ID or an instance number, e.g. I0003 for 3
+    """
+    if instance.isdigit():
+        return "I" + instance.zfill(4)
+    return instance
+
+
+def get_input_paths(dem_file):
+    """
+        Paths to the demand and capacity files of an instance
+    """
+    instance = get_instance(dem_file)
+    extension = os.path.splitext(dem_file)[1]
+    cap_file = instance + "_capacity" + extension
+
+    return (os.path.join("schedules", "demand", dem_file),
+            os.path.join("schedules", "capacity", cap_file))
+
+
+def get_metadata_path(dem_file):
+    """
+        Path to the YAML metadata file of an instance, which only exists for
+        instances written as CSV files
+    """
+    return os.path.join("schedules", "metadata",
+                        get_instance(dem_file) + "_metadata.yml")
+
+
+def select_demand_files(instances=None):
+    """
+        Sorted names of the demand files in schedules/demand, one per
+        instance, only for the given instance IDs or numbers if any. An
+        instance written in several formats is read from the first of them
+        in TABLE_FORMATS. Returns the names and the IDs of the requested
+        instances without a demand file
+    """
+    dirpath = os.path.join(os.getcwd(), "schedules", "demand")
+    extensions = list(TABLE_FORMATS.values())
+
+    # Files in formats listed first come first, and are kept
+    dem_files = dict()
+    for dem_file in sorted(
+            (f for f in os.listdir(dirpath) if is_file(f, dirpath)),
+            key=lambda f: get_format_rank(f, extensions)):
+        dem_files.setdefault(get_instance(dem_file), dem_file)
+
+    dem_filenames = sorted(dem_files.values())
+
+    if not instances:
+        return dem_filenames, []
+
+    selected = {get_instance_id(instance) for instance in instances}
+    dem_filenames = [f for f in dem_filenames if get_instance(f) in selected]
+    missing = selected - {get_instance(f) for f in dem_filenames}
+
+    return dem_filenames, sorted(missing)
+
+
+def get_format_rank(filename, extensions):
+    """
+        Position of the extension of a file in a list of extensions, after
+        all of them if it is not listed
+    """
+    extension = os.path.splitext(filename)[1]
+    if extension in extensions:
+        return extensions.index(extension)
+    return len(extensions)
 
 
 def mkdir_p(path):
@@ -26,3 +127,148 @@ def safe_open(path):
     """
     mkdir_p(os.path.dirname(path))
     return open(path, 'w')
+
+
+def hash_files(paths):
+    """
+        SHA-256 hex digest of the contents of a list of files, in order
+    """
+    digest = hashlib.sha256()
+
+    for path in paths:
+        with open(path, "rb") as infile:
+            for chunk in iter(lambda: infile.read(1 << 20), b""):
+                digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def read_yaml(path, default=None):
+    """
+        Load a YAML file, or return default if it does not exist
+    """
+    if not os.path.exists(path):
+        return default
+
+    import yaml
+
+    with open(path) as stream:
+        return yaml.safe_load(stream)
+
+
+def write_yaml(data, path):
+    """
+        Dump data to a YAML file, replacing it at once so that readers never
+        see a partially written file
+    """
+    import yaml
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with safe_open(tmp_path) as outfile:
+        yaml.dump(data, outfile, default_flow_style=False)
+
+    os.replace(tmp_path, path)
+
+
+def import_pyarrow():
+    """
+        Import pyarrow, which is only needed for Parquet and Feather files
+    """
+    try:
+        import pyarrow
+        import pyarrow.feather
+        import pyarrow.parquet
+    except ImportError as exc:
+        raise ImportError(
+            "Parquet and Feather files require pyarrow, install it with "
+            "'pip install pyarrow'") from exc
+
+    return pyarrow
+
+
+def write_table(table_df, path, metadata=None):
+    """
+        Write a DataFrame in the format given by the extension of path. For
+        Parquet and Feather files, metadata (a dictionary) is stored as YAML
+        in the file-level key/value metadata. CSV files cannot hold metadata
+    """
+    extension = os.path.splitext(path)[1]
+
+    if extension == TABLE_FORMATS["csv"]:
+        assert metadata is None
+        table_df.to_csv(path, index=None)
+        return
+
+    pyarrow = import_pyarrow()
+    table = pyarrow.Table.from_pandas(table_df, preserve_index=False)
+
+    if metadata is not None:
+        import yaml
+
+        schema_metadata = dict(table.schema.metadata or {})
+        schema_metadata[METADATA_KEY] = yaml.dump(
+            metadata, default_flow_style=False)
+        table = table.replace_schema_metadata(schema_metadata)
+
+    if extension == TABLE_FORMATS["parquet"]:
+        pyarrow.parquet.write_table(table, path)
+    else:
+        assert extension == TABLE_FORMATS["feather"]
+        pyarrow.feather.write_feather(table, path)
+
+
+def read_table(path):
+    """
+        Read a DataFrame from a file in any of the supported formats. Returns
+        the DataFrame and the metadata stored in the file (None for CSV files
+        or if there is none)
+    """
+    import pandas as pd
+
+    extension = os.path.splitext(path)[1]
+
+    if extension == TABLE_FORMATS["csv"]:
+        return pd.read_csv(path), None
+
+    pyarrow = import_pyarrow()
+    if extension == TABLE_FORMATS["parquet"]:
+        table = pyarrow.parquet.read_table(path)
+    else:
+        assert extension == TABLE_FORMATS["feather"]
+        table = pyarrow.feather.read_table(path)
+
+    metadata = (table.schema.metadata or {}).get(METADATA_KEY)
+    if metadata is not None:
+        import yaml
+
+        metadata = yaml.safe_load(metadata)
+
+    return table.to_pandas(), metadata
+
+
+def read_schedule(path):
+    """
+        Read a demand file in any of the supported formats and bring it to
+        the same form: dates as day offsets from the start of the season,
+        categorical columns as plain values and missing turnaround values as
+        empty strings. Returns the schedule and the metadata in the file
+    """
+    import pandas as pd
+
+    dem_df, metadata = read_table(path)
+
+    if pd.api.types.is_datetime64_any_dtype(dem_df["StartDate"]):
+        dem_df["StartDate"] = utils_dates.datetime64_to_days(
+            dem_df["StartDate"])
+        dem_df["EndDate"] = utils_dates.datetime64_to_days(dem_df["EndDate"])
+        for column in dem_df.columns:
+            if dem_df[column].dtype.name in ["category", "Int32"]:
+                dem_df[column] = dem_df[column].astype(object).where(
+                    dem_df[column].notna(), "")
+        return dem_df, metadata
+
+    dem_df = dem_df.replace(np.nan, '', regex=True)
+    dem_df["StartDate"] = utils_dates.strs_to_days(dem_df["StartDate"])
+    dem_df["EndDate"] = utils_dates.strs_to_days(dem_df["EndDate"])
+
+    return dem_df, metadata
@@ -4,6 +4,7 @@ This script contains support functions for generate.py and visualise.py scripts
 """
 
 import numpy as np
+import utils_cap
 import utils_dates
 import utils_times
 
@@ -11,25 +12,25 @@ import utils_times
 dom_airports = ["ZZJ", "ZZD"]
 
 
-def get_count_flights(start_date_str, end_date_str, freq):
+def get_count_flights(start_day, end_day, freq):
     """
-        For a given service (row), select all days between start and end data
-        that match the days of the week given in the frequency field.
-        Return a list of all selected dates for each service.
+        For a given service (row), count all days between start and end date
+        that match the days of the week given in the frequency field
     """
-    start_date = utils_dates.str_to_date(start_date_str)
-    end_date = utils_dates.str_to_date(end_date_str)
+    return int(get_count_flights_array([start_day], [end_day], [freq])[0])
 
-    weekdays = utils_dates.freq_str_to_weekdays(freq)
-    start_weekday = start_date.weekday()
 
-    # Calculate intervals to add these movements
-    day_count = 0
-    for day in range((end_date - start_date).days + 1):
-        if (start_weekday + day) % 7 + 1 in weekdays:
-            day_count += 1
+def get_count_flights_array(start_days, end_days, freqs):
+    """
+        Vectorised version of get_count_flights for arrays of start/end days
+        and frequencies (strings or a (series x 7) boolean array of operating
+        weekdays), computed in closed form
+    """
+    weekday_masks = np.asarray(freqs)
+    if weekday_masks.ndim == 1:
+        weekday_masks = utils_dates.freqs_to_weekday_masks(weekday_masks)
 
-    return day_count
+    return utils_dates.count_weekdays(start_days, end_days, weekday_masks)
 
 
 def is_linked(turnCarrier):
@@ -86,7 +87,7 @@ def get_relevant_time_idx_from_min(flight_minutes, cap_lim):
     """
     relevant_time_idx = []
 
-    for j, time in enumerate(cap_lim["Time"]):
+    for j, time in enumerate(utils_cap.get_times(cap_lim)):
         if time + cap_lim["Duration"] - 1 < flight_minutes:
             continue
 
@@ -111,73 +112,248 @@ def get_relevant_time_idx_from_flight(flight_row, cap_lim):
     return relevant_time_idx
 
 
-def get_initial_demand(schedule_df, cap_lims):
+def get_compatible_mask(schedule_df, cap_lim):
     """
-        Populate dictionaries with demand curves for each capacity constraint
-        using times given in "Time" field of each request
+        Vectorised version of is_compatible, returns a boolean array with one
+        element per request in schedule_df
     """
-    first_date, last_date = utils_dates.get_first_last_dates(schedule_df)
+    compat = np.ones(len(schedule_df), dtype=bool)
 
-    # Initialise demand data structure
-    demand = [0 for elem in range(len(cap_lims))]
-    for c_idx, cap_lim in enumerate(cap_lims):
-        limit_size = np.zeros(len(cap_lim["Time"]))
-        demand[c_idx] = dict()
+    if cap_lim["ArrDep"] != "T":
+        compat &= schedule_df["ArrDep"].values == cap_lim["ArrDep"]
+
+    if cap_lim["Resource"] == "P":
+        compat &= schedule_df["Seats"].values != 0
+
+    if cap_lim["DomInt"] != "T":
+        is_dom = np.isin(schedule_df["OrigDest"].values, dom_airports)
+        compat &= is_dom == (cap_lim["DomInt"] == "D")
+
+    return compat
+
+
+def get_resource_usage(schedule_df, cap_lim):
+    """
+        Amount of the resource limited by cap_lim that each request uses
+    """
+    if cap_lim["Resource"] == 'P':
+        if "Pax" not in schedule_df.columns:
+            return (schedule_df["Seats"].values * 0.88).astype(int)
+        return schedule_df["Pax"].values.astype(int)
+
+    assert cap_lim["Resource"] == 'M'
+    return np.ones(len(schedule_df), dtype=int)
+
+
+def get_req_minutes(schedule_df):
+    """
+        Requested times ('HHMM' strings or ints) as minutes after midnight
+    """
+    req = np.asarray(schedule_df["Req"].values).astype(int)
+    hours, minutes = req // 100, req % 100
+
+    assert np.all((0 <= hours) & (hours <= 23))
+    assert np.all((0 <= minutes) & (minutes <= 55))
+
+    return hours * 60 + minutes
 
-        # Initialise demand as all zeros for all c, j, d
-        for date in utils_dates.date_range(first_date, last_date):
-            demand[c_idx][utils_dates.date_to_str(date)] = limit_size.copy()
 
-    # Get valid dates for each flight
-    schedule_df["valid_dates"] = schedule_df.apply(
-        lambda x: utils_dates.select_dates(x), axis=1)
+def get_turnaround_pairs(schedule_df):
+    """
+        Match each linked arrival with the first departure operated by its
+        turnaround carrier and flight number and starting on the same date.
+        Missing turnaround carriers are empty strings. Returns the positions
+        of the matched arrivals and of their departures
+    """
+    turn_carriers = schedule_df["TurnCarrier"].values.astype(str)
+    arr_deps = schedule_df["ArrDep"].values
+    is_linked = turn_carriers != ""
+
+    arr_idx = np.flatnonzero(is_linked & (arr_deps == "A"))
+    dep_idx = np.flatnonzero(is_linked & (arr_deps == "D"))
+
+    # Key (carrier, flight number, start date) of arrivals and departures
+    carriers = np.r_[turn_carriers[arr_idx],
+                     schedule_df["Carrier"].values[dep_idx].astype(str)]
+    fl_nums = np.r_[schedule_df["TurnFlNum"].values[arr_idx].astype(int),
+                    schedule_df["FlNum"].values[dep_idx].astype(int)]
+    start_days = schedule_df["StartDate"].values[np.r_[arr_idx, dep_idx]]
+
+    if len(carriers) == 0:
+        return arr_idx, dep_idx
+
+    # Combine the three parts of a key into one integer
+    carrier_codes = np.unique(carriers, return_inverse=True)[1].ravel()
+    start_days = start_days - start_days.min()
+    keys = (carrier_codes * (fl_nums.max() + 1) + fl_nums) * \
+        (start_days.max() + 1) + start_days
+    arr_keys, dep_keys = keys[:len(arr_idx)], keys[len(arr_idx):]
+
+    # Look up the first departure with the key of each arrival
+    order = np.argsort(dep_keys, kind="stable")
+    sorted_keys = np.r_[dep_keys[order], -1]
+    pos = np.searchsorted(dep_keys[order], arr_keys)
+    is_matched = sorted_keys[pos] == arr_keys
+
+    return arr_idx[is_matched], dep_idx[order[pos[is_matched]]]
+
+
+def get_demand_tensor(schedule_df, cap_lims, window_lookups=None):
+    """
+        Compute demand for every capacity constraint, day and time window as a
+        dense (constraint x day x window) integer array. Constraints with fewer
+        windows than the longest one are padded with zeros. window_lookups are
+        the minute to time window tables from utils_cap.get_window_lookups,
+        built here if not given. Returns the array together with the first day
+        (offset from the start of the season) it refers to
+    """
+    if window_lookups is None:
+        window_lookups = utils_cap.get_window_lookups(cap_lims)
+
+    first_day, last_day = utils_dates.get_first_last_dates(schedule_df)
+    num_days = last_day - first_day + 1
+    max_windows = max(cap_lim["Count"] for cap_lim in cap_lims)
+
+    demand = np.zeros((len(cap_lims), num_days, max_windows), dtype=np.int64)
+
+    # Days on which each request operates (day x series)
+    dates_mask = utils_dates.select_dates_matrix(
+        schedule_df["StartDate"].values, schedule_df["EndDate"].values,
+        schedule_df["FREQ"].values, first_day, num_days).astype(float)
+
+    req_minutes = get_req_minutes(schedule_df)
+    series_idx = np.arange(len(schedule_df))
 
     for c_idx, cap_lim in enumerate(cap_lims):
-        # Get subset of flights compatible with this capacity constraint
-        compat = schedule_df.apply(lambda x: is_compatible(x, cap_lim), axis=1)
-        subset_df = schedule_df[compat]
+        num_windows = cap_lim["Count"]
+        first_idx, last_idx = window_lookups[c_idx]
 
-        # Get relevant times for each flight
-        relevant_time_idx = subset_df.apply(
-            lambda x: get_relevant_time_idx_from_flight(x, cap_lim), axis=1)
+        # Series x window incidence, weighted by the resource used, stored as
+        # differences between consecutive windows
+        weights = get_resource_usage(schedule_df, cap_lim) * \
+            get_compatible_mask(schedule_df, cap_lim)
+        weights = np.where(
+            first_idx[req_minutes] <= last_idx[req_minutes], weights, 0)
 
-        # For each flight
-        for i_idx, flight_row in subset_df.iterrows():
-            # Define resource to add
-            if cap_lim["Resource"] == 'P':
-                if "Pax" not in flight_row.index:
-                    resource = int(flight_row["Seats"] * 0.88)
-                else:
-                    resource = flight_row["Pax"]
-            elif cap_lim["Resource"] == 'M':
-                resource = 1
+        incidence = np.zeros((len(schedule_df), num_windows + 1))
+        np.add.at(incidence, (series_idx, first_idx[req_minutes]), weights)
+        np.add.at(incidence, (series_idx, last_idx[req_minutes] + 1), -weights)
 
-            # For each date
-            for date in flight_row["valid_dates"]:
-                # For each time
-                for j_idx in relevant_time_idx[i_idx]:
-                    date_str = utils_dates.date_to_str(date)
-                    demand[c_idx][date_str][j_idx] += resource
+        # Values are integers well below 2**53 so the product is exact
+        demand[c_idx, :, :num_windows] = np.rint(
+            np.cumsum(dates_mask @ incidence, axis=1)[:, :num_windows])
 
-    schedule_df.drop("valid_dates", axis=1)
+    return demand, first_day
 
-    return demand
+
+def demand_tensor_to_dicts(demand, first_day, cap_lims):
+    """
+        Present a demand tensor as a list with one dictionary per capacity
+        constraint, mapping each date string to that day's demand curve. The
+        curves are views on the tensor
+    """
+    date_strs = utils_dates.days_to_strs(
+        first_day + np.arange(demand.shape[1]))
+
+    demand_dicts = []
+    for c_idx, cap_lim in enumerate(cap_lims):
+        num_windows = cap_lim["Count"]
+        demand_dicts.append({
+            date_str: demand[c_idx, d_idx, :num_windows]
+            for d_idx, date_str in enumerate(date_strs)})
+
+    return demand_dicts
+
+
+def get_initial_demand(schedule_df, cap_lims, window_lookups=None):
+    """
+        Populate dictionaries with demand curves for each capacity constraint
+        using times given in "Time" field of each request
+    """
+    demand, first_day = get_demand_tensor(
+        schedule_df, cap_lims, window_lookups)
+
+    return demand_tensor_to_dicts(demand, first_day, cap_lims)
 
 
 def get_percentile_demand(demand, percentile_q):
     """
         Get the qth percentile of all demand points corresponding to each
-        capacity constraint
+        capacity constraint. percentile_q can be a number or a sequence of
+        percentiles, in which case one row per constraint is returned
     """
     percentiles = []
 
     for _, elem_c in enumerate(demand):
-
-        limits = []
-        for _, elem_d in elem_c.items():
-            # assert elem_d.sum() > 0
-            limits.extend(list(elem_d))
+        limits = np.stack(list(elem_c.values()))
 
         percentiles.append(np.percentile(limits, percentile_q))
 
+    return np.array(percentiles)
+
+
+def get_percentile_demand_tensor(demand, cap_lims, percentile_q):
+    """
+        Get the qth percentile(s) of all demand points corresponding to each
+        capacity constraint, working directly on the demand tensor from
+        get_demand_tensor. Constraints with the same number of windows are
+        handled in a single call
+    """
+    num_windows = np.array([cap_lim["Count"] for cap_lim in cap_lims])
+    percentiles = np.zeros((len(cap_lims),) + np.shape(percentile_q))
+
+    for width in np.unique(num_windows):
+        c_idx = np.flatnonzero(num_windows == width)
+        limits = demand[c_idx, :, :width].reshape(len(c_idx), -1)
+
+        # Percentiles come first in the output of np.percentile
+        percentiles[c_idx] = np.moveaxis(
+            np.percentile(limits, percentile_q, axis=1), 0, -1)
+
+    return percentiles
+
+
+def init_demand_histograms(cap_lims):
+    """
+        Initialise histograms counting how many times each demand value has
+        been seen for each capacity constraint. Memory depends on the largest
+        demand value, not on the number of demand points
+    """
+    return [np.zeros(1, dtype=np.int64) for _ in cap_lims]
+
+
+def update_demand_histograms(histograms, demand, cap_lims):
+    """
+        Add demand points to the histograms of each capacity constraint.
+        demand can hold one day (constraint x window) or several days
+        (constraint x day x window), e.g. a slice of the demand tensor
+    """
+    for c_idx, cap_lim in enumerate(cap_lims):
+        values = demand[c_idx, ..., :cap_lim["Count"]].ravel()
+        counts = np.bincount(values, minlength=len(histograms[c_idx]))
+        counts[:len(histograms[c_idx])] += histograms[c_idx]
+        histograms[c_idx] = counts
+
+    return histograms
+
+
+def get_percentile_demand_histograms(histograms, percentile_q):
+    """
+        Get the qth percentile(s) of the demand points counted in the
+        histograms of each capacity constraint, interpolating linearly between
+        closest ranks as np.percentile does
+    """
+    q = np.asarray(percentile_q, dtype=float) / 100
+    percentiles = np.zeros((len(histograms),) + q.shape)
+
+    for c_idx, counts in enumerate(histograms):
+        cum_counts = np.cumsum(counts)
+
+        # Rank (position in the sorted demand points) of each percentile
+        rank = q * (cum_counts[-1] - 1)
+        lower = np.searchsorted(cum_counts, np.floor(rank), side="right")
+        upper = np.searchsorted(cum_counts, np.ceil(rank), side="right")
+
+        percentiles[c_idx] = lower + (upper - lower) * (rank - np.floor(rank))
+
     return percentiles
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+"""
+This script contains functions measuring the time and memory used by each
+stage of generating an instance, as reported by generate.py --instrument
+"""
+
+import contextlib
+import json
+import os
+import time
+import tracemalloc
+
+
+# Recorder of the instance being generated in this process, if any
+_RECORDER = None
+
+
+class Recorder:
+    """
+        Measurements of the stages run while recording, by stage name. Each
+        stage has its running time in seconds, the resident set size of the
+        process at its end and its change over the stage and, if memory is
+        traced, the peak memory allocated during the stage (in bytes). Stages
+        can be nested, in which case the outer stage includes the inner ones
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = dict()
+        # Peak traced memory of each open stage before its inner stages
+        # reset the peak, outermost first
+        self.peaks = []
+
+    def start(self):
+        """
+            Start measuring a stage. Returns the state needed by stop
+        """
+        rss = get_rss()
+        if not self.trace_memory:
+            return None, rss, time.perf_counter()
+
+        current, peak = tracemalloc.get_traced_memory()
+        if self.peaks:
+            self.peaks[-1] = max(self.peaks[-1], peak)
+        self.peaks.append(current)
+        tracemalloc.reset_peak()
+
+        return current, rss, time.perf_counter()
+
+    def stop(self, name, state):
+        """
+            Finish measuring a stage and record it
+        """
+        start_memory, start_rss, start_time = state
+        measures = {"time": time.perf_counter() - start_time}
+
+        if self.trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            peak = max(self.peaks.pop(), peak)
+            if self.peaks:
+                self.peaks[-1] = max(self.peaks[-1], peak)
+            measures["peak_memory"] = peak - start_memory
+
+        rss = get_rss()
+        if rss is not None and start_rss is not None:
+            measures["rss"] = rss
+            measures["rss_change"] = rss - start_rss
+
+        self.stages[name] = measures
+
+
+def get_rss():
+    """
+        Current resident set size of this process, in bytes (None if not
+        available on this platform)
+    """
+    # The maximum so far (resource.getrusage) would hide what each stage
+    # uses once an earlier stage has reached it, so read the current size
+    try:
+        with open("/proc/self/statm") as infile:
+            resident_pages = int(infile.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+@contextlib.contextmanager
+def recording(trace_memory=False):
+    """
+        Record every stage run in this process inside the block. Yields the
+        recorder. Tracing memory with tracemalloc slows everything down
+    """
+    global _RECORDER
+    previous = _RECORDER
+    _RECORDER = Recorder(trace_memory)
+
+    if trace_memory:
+        tracemalloc.start()
+
+    try:
+        yield _RECORDER
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+        _RECORDER = previous
+
+
+@contextlib.contextmanager
+def stage(name):
+    """
+        Measure the code inside the block (or the decorated function) as a
+        stage of the current recording. Does nothing if not recording
+    """
+    recorder = _RECORDER
+    if recorder is None:
+        yield
+        return
+
+    state = recorder.start()
+    try:
+        yield
+    finally:
+        recorder.stop(name, state)
+
+
+def write_record(record, outfile):
+    """
+        Write a record as a single line of JSON
+    """
+    outfile.write(json.dumps(record) + "\n")
+    outfile.flush()
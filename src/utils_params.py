@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+"""
+This script contains functions loading, validating and compiling the
+parameters in parameters.yml, with compiled parameters cached to a binary
+file so that they are only parsed again when the file changes
+"""
+
+import contextlib
+import math
+import os
+import pickle
+import utils_cap
+import utils_dates
+import utils_files
+import utils_sample
+
+
+# Compiled parameters, named after the hash of their YAML file
+PARAMS_CACHE_DIR = os.path.join("schedules", "cache")
+
+# Source files of the code compiling the parameters, part of the cache key
+COMPILER_FILES = [__file__, utils_cap.__file__, utils_dates.__file__,
+                  utils_files.__file__, utils_sample.__file__]
+
+# Fields of the capacity specs in parameters.yml, in the order they are listed
+CAPACITY_FIELDS = ["Resource", "ArrDep", "DomInt", "Duration", "Step"]
+
+# Parameters with one option per profile
+PROFILE_FIELDS = ["capacity", "daily_demand", "proportion_linked", "seats",
+                  "start_end_weeks", "turn_times", "weeklyfreq_a",
+                  "weeklyfreq_b"]
+
+# Parameters with a minimum and a maximum
+RANGE_FIELDS = {"capacity_ratios": ("min", "max"),
+                "dom_req": ("min_p", "max_p"),
+                "schedule_size": ("min_days", "max_days"),
+                "season_demand": ("min_k", "max_k")}
+
+# Ranges of integers sampled with rng.integers, which excludes the maximum
+INTEGER_RANGE_FIELDS = ["schedule_size", "season_demand"]
+
+WEEKDAY_NAMES = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+
+def load_parameters(path="parameters.yml", cache_dir=PARAMS_CACHE_DIR):
+    """
+        Parameters in a YAML file, validated and compiled (see
+        compile_parameters). They are read from the cache in cache_dir if the
+        file and the code compiling them have not changed since they were
+        last compiled. The cache is best-effort: parameters are compiled in
+        memory if it cannot be read or written, and without touching the disk
+        if cache_dir is None
+    """
+    cache_path = None
+    if cache_dir is not None:
+        key = utils_files.hash_files([path] + COMPILER_FILES)[:16]
+        cache_path = os.path.join(cache_dir, f"parameters_{key}.pickle")
+
+        params = read_cache(cache_path)
+        if params is not None:
+            return params
+
+    import yaml
+
+    with open(path) as stream:
+        try:
+            params = yaml.safe_load(stream)
+        except yaml.YAMLError as exc:
+            print(exc)
+            raise
+
+    params = compile_parameters(params, path)
+
+    if cache_path is not None:
+        write_cache(params, cache_path)
+
+    return params
+
+
+def read_cache(cache_path):
+    """
+        Compiled parameters cached in a file, None if it does not exist or
+        cannot be read
+    """
+    try:
+        with open(cache_path, "rb") as infile:
+            return pickle.load(infile)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+
+def write_cache(params, cache_path):
+    """
+        Cache compiled parameters in a file, if it can be written
+    """
+    # Replaced at once, so that other processes never read a partial file
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        utils_files.mkdir_p(os.path.dirname(cache_path))
+        with open(tmp_path, "wb") as outfile:
+            pickle.dump(params, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+
+
+def compile_parameters(params, source="parameters"):
+    """
+        Validate parameters as loaded from a YAML file, raising a ValueError
+        naming source and the invalid entry otherwise, and compile them:
+        capacity specs become dictionaries by field name and the samplers of
+        every option of each sampled parameter are built in advance (see
+        utils_sample.compile_profile_samplers), under "samplers"
+    """
+    try:
+        return compile_checked_parameters(params)
+    except ValueError as exc:
+        raise ValueError(f"{source}: {exc}") from None
+
+
+def compile_checked_parameters(params):
+    """
+        Validate and compile parameters (see compile_parameters)
+    """
+    missing = set(PROFILE_FIELDS) | set(RANGE_FIELDS) | {"seat_load_factor"}
+    missing -= set(params)
+    check(not missing, "parameters", f"missing {', '.join(sorted(missing))}")
+
+    for name, (min_key, max_key) in RANGE_FIELDS.items():
+        range_ = params[name]
+        check(isinstance(range_, dict) and {min_key, max_key} <= set(range_),
+              name, f"must have {min_key} and {max_key}")
+        check(is_number(range_[min_key]) and is_number(range_[max_key]) and
+              0 <= range_[min_key] <= range_[max_key],
+              name, f"must have 0 <= {min_key} <= {max_key}")
+
+    for name in INTEGER_RANGE_FIELDS:
+        min_key, max_key = RANGE_FIELDS[name]
+        check(is_integer(params[name][min_key]) and
+              is_integer(params[name][max_key]) and
+              params[name][min_key] < params[name][max_key], name,
+              f"must have integers {min_key} < {max_key} ({max_key} is "
+              "excluded)")
+
+    check(params["schedule_size"]["min_days"] >= 1, "schedule_size",
+          "min_days must be >= 1")
+    check(params["dom_req"]["max_p"] <= 1, "dom_req", "max_p must be <= 1")
+
+    for name in PROFILE_FIELDS:
+        check(isinstance(params[name], dict) and params[name], name,
+              "must have at least one option")
+
+    compiled = dict(params)
+    compiled["capacity"] = {
+        option: compile_capacity(specs, f"capacity.{option}")
+        for option, specs in params["capacity"].items()}
+
+    for option, value in params["proportion_linked"].items():
+        check(is_number(value) and 0 <= value <= 1,
+              f"proportion_linked.{option}", "must be between 0 and 1")
+
+    samplers = dict()
+    for name in utils_sample.SAMPLED_PARAMETERS:
+        if name == "seat_load_factor":
+            check_profile(name, params[name], name)
+            samplers[name] = utils_sample.compile_profile_samplers(
+                name, params[name])
+            continue
+
+        samplers[name] = dict()
+        for option, profile in params[name].items():
+            check_profile(name, profile, f"{name}.{option}")
+            samplers[name][option] = utils_sample.compile_profile_samplers(
+                name, profile)
+
+    # Weekdays are drawn without replacement and profiles are chosen
+    # independently, so every option of weeklyfreq_b must have enough
+    # possible weekdays for the largest number in any option of weeklyfreq_a
+    max_weekdays = max(num_weekdays
+                       for profile in params["weeklyfreq_a"].values()
+                       for num_weekdays, prob in profile.items() if prob > 0)
+    for option, profile in params["weeklyfreq_b"].items():
+        check(sum(prob > 0 for prob in profile.values()) >= max_weekdays,
+              f"weeklyfreq_b.{option}",
+              f"must have at least {max_weekdays} weekdays with non-zero "
+              "probability, as weeklyfreq_a can draw that many")
+
+    compiled["samplers"] = samplers
+
+    return compiled
+
+
+def check(condition, location, message):
+    """
+        Raise a ValueError about the parameter at location unless condition
+    """
+    if not condition:
+        raise ValueError(f"{location}: {message}")
+
+
+def compile_capacity(specs, location):
+    """
+        Capacity specs of a capacity profile as dictionaries by field name
+        (see CAPACITY_FIELDS), from lists such as [M, D, T, 60, 60]
+    """
+    check(isinstance(specs, list) and specs, location,
+          "must be a list of capacity specs")
+
+    records = []
+    for s_idx, spec in enumerate(specs):
+        spec_location = f"{location}[{s_idx}]"
+        check(isinstance(spec, list) and len(spec) == len(CAPACITY_FIELDS),
+              spec_location, f"must be [{', '.join(CAPACITY_FIELDS)}]")
+
+        record = dict(zip(CAPACITY_FIELDS, spec))
+        check(record["Resource"] in utils_cap.RESOURCE_NAMES, spec_location,
+              f"unknown resource {record['Resource']}")
+        check(record["ArrDep"] in ["A", "D", "T"], spec_location,
+              f"unknown arrivals/departures {record['ArrDep']}")
+        check(record["DomInt"] in ["D", "I", "T"], spec_location,
+              f"unknown domestic/international {record['DomInt']}")
+        check(isinstance(record["Duration"], int) and record["Duration"] > 0,
+              spec_location, "duration must be a positive number of minutes")
+        check(isinstance(record["Step"], int) and record["Step"] > 0 and
+              (24 * 60) % record["Step"] == 0, spec_location,
+              "step must be a number of minutes dividing a day")
+
+        records.append(record)
+
+    return records
+
+
+def check_profile(name, profile, location):
+    """
+        Check one option of a sampled parameter: its probabilities and the
+        values they are given for
+    """
+    if name == "daily_demand":
+        check(isinstance(profile, dict) and {"A", "D"} <= set(profile),
+              location, "must have curves A and D")
+        for flag in ("A", "D"):
+            num_intervals = utils_sample.NUM_TIME_INTERVALS
+            check(isinstance(profile[flag], list) and
+                  num_intervals % len(profile[flag]) == 0,
+                  f"{location}.{flag}",
+                  "must be a list of probabilities of intervals grouping the "
+                  f"{num_intervals} 5-minute intervals of a day evenly")
+            check_probs(profile[flag], f"{location}.{flag}")
+        return
+
+    check(isinstance(profile, dict) and profile, location,
+          "must be a dictionary of probabilities")
+    check_probs(list(profile.values()), location)
+
+    if name == "weeklyfreq_b":
+        check(sorted(profile) == sorted(WEEKDAY_NAMES), location,
+              "must have one probability per weekday")
+    elif name == "start_end_weeks":
+        for weeks in profile:
+            start_end = str(weeks).split(",")
+            check(len(start_end) == 2 and
+                  all(week.strip().isdigit() for week in start_end) and
+                  int(start_end[0]) <= int(start_end[1]),
+                  location, f"invalid start and end weeks '{weeks}'")
+            # Series must start before the last week of the season
+            check(utils_dates.FIRST_WEEK <= int(start_end[0]) <
+                  utils_dates.LAST_WEEK, location,
+                  f"start week of '{weeks}' must be between "
+                  f"{utils_dates.FIRST_WEEK} and {utils_dates.LAST_WEEK - 1}")
+    elif name == "weeklyfreq_a":
+        check(set(profile) <= set(range(1, 8)), location,
+              "numbers of weekdays must be between 1 and 7")
+    else:
+        check(all(is_number(value) and value >= 0 for value in profile),
+              location, "values must be non-negative numbers")
+
+
+def check_probs(probs, location):
+    """
+        Check that probabilities are finite, non-negative and not all zero
+    """
+    check(all(is_number(prob) and prob >= 0 for prob in probs) and
+          sum(probs) > 0, location,
+          "probabilities must be non-negative and not all zero")
+
+
+def is_integer(value):
+    """
+        Whether a value is an int (but not a bool)
+    """
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def is_number(value):
+    """
+        Whether a value is a finite int or float (but not a bool)
+    """
+    return isinstance(value, (int, float)) and \
+        not isinstance(value, bool) and math.isfinite(value)
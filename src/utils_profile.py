@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+"""
+This script contains functions profiling the generation or report of an
+instance, as done by generate.py --profile and visualise.py --profile
+"""
+
+import cProfile
+import collections
+import os
+import pstats
+import sys
+import threading
+
+
+# Profiles of instances, named after the instance and the profiled script
+PROFILES_DIR = os.path.join("schedules", "profiles")
+
+# Seconds between stack samples written to collapsed stack files
+SAMPLE_INTERVAL = 0.001
+
+# Number of hot functions printed for each profile
+TOP_FUNCTIONS = 15
+
+
+class StackSampler:
+    """
+        Sample the Python stack of the current thread at regular intervals
+        from a background thread, counting how often each stack is seen.
+        Stacks are tuples of "module:function" labels, outermost first, and
+        only hold the frames called from the frame the sampler was created in
+        (apart from the first one, e.g. Profile.runcall)
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.thread_id = threading.get_ident()
+        self.root_frame = sys._getframe(1)
+        self.interval = interval
+        self.counts = collections.Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        """
+            Sample until stopped
+        """
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+
+            stack = []
+            while frame is not None and frame is not self.root_frame:
+                code = frame.f_code
+                stack.append(
+                    f"{get_module_name(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+
+            if len(stack) > 1:
+                self.counts[tuple(reversed(stack[:-1]))] += 1
+
+    def write_collapsed(self, path):
+        """
+            Write the sampled stacks in collapsed format, one "a;b;c count"
+            line per stack, as read by flamegraph.pl, speedscope or inferno
+        """
+        with open(path, "w") as outfile:
+            for stack, count in sorted(self.counts.items()):
+                outfile.write(";".join(stack) + f" {count}\n")
+
+
+def get_module_name(filename):
+    """
+        Short module name of a source file: the script name for modules of
+        this project (e.g. utils_flights) and the top-level package for
+        installed and standard library modules (e.g. numpy)
+    """
+    if filename == "~":
+        return "<built-in>"
+
+    if filename.startswith("<"):
+        return filename
+
+    filename = os.path.abspath(filename)
+    if os.path.dirname(filename) == os.path.dirname(os.path.abspath(__file__)):
+        return os.path.splitext(os.path.basename(filename))[0]
+
+    # Longest entry of the path containing the file
+    for path in sorted(sys.path, key=len, reverse=True):
+        path = os.path.abspath(path or os.curdir)
+        if filename.startswith(path + os.sep):
+            top_level = os.path.relpath(filename, path).split(os.sep)[0]
+            return os.path.splitext(top_level)[0]
+
+    return os.path.splitext(os.path.basename(filename))[0]
+
+
+def get_hot_functions(stats, top=TOP_FUNCTIONS):
+    """
+        The top functions of a pstats.Stats by own time, grouped by module.
+        Returns a list of (module, module own time, functions) with the
+        functions as (name, own time, cumulative time, calls), modules in
+        decreasing order of their total own time
+    """
+    functions = sorted(stats.stats.items(), key=lambda item: -item[1][2])
+
+    module_times = collections.Counter()
+    for (filename, _, _), (_, _, own_time, _, _) in functions:
+        module_times[get_module_name(filename)] += own_time
+
+    hot_functions = collections.defaultdict(list)
+    for (filename, line, name), (_, calls, own_time, cum_time, _) in \
+            functions[:top]:
+        if filename != "~":
+            name = f"{name} (line {line})"
+        hot_functions[get_module_name(filename)].append(
+            (name, own_time, cum_time, calls))
+
+    return [(module, module_times[module], hot_functions[module])
+            for module in sorted(hot_functions, key=module_times.get,
+                                 reverse=True)]
+
+
+def print_hot_functions(stats, title, top=TOP_FUNCTIONS):
+    """
+        Print the top functions of a pstats.Stats by own time, grouped by
+        module
+    """
+    lines = [f"\n{title}: top {top} functions by own time "
+             f"({stats.total_tt:.3f}s in total)"]
+
+    for module, module_time, functions in get_hot_functions(stats, top):
+        lines.append(f"  {module} ({module_time:.3f}s in module)")
+        for name, own_time, cum_time, calls in functions:
+            lines.append(f"    {own_time:8.3f}s own {cum_time:8.3f}s cum "
+                         f"{calls:>9} calls  {name}")
+
+    # Single write, so that reports of parallel workers do not interleave
+    print("\n".join(lines))
+
+
+def profile_call(name, func, *args, **kwargs):
+    """
+        Run func(*args, **kwargs) with cProfile and a stack sampler, write
+        name.pstats and name.collapsed to PROFILES_DIR and print the hot
+        functions. Returns the output of func
+    """
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    path = os.path.join(PROFILES_DIR, name)
+
+    profiler = cProfile.Profile()
+    with StackSampler() as sampler:
+        output = profiler.runcall(func, *args, **kwargs)
+
+    profiler.dump_stats(path + ".pstats")
+    sampler.write_collapsed(path + ".collapsed")
+
+    print_hot_functions(pstats.Stats(profiler), name)
+
+    return output
@@ -4,13 +4,21 @@ This script contains support functions for generate.py and visualise.py scripts
 """
 
 import numpy as np
+import utils_dates
 import utils_times
 
 
-np.random.seed(seed=42)
+# Parameters sampled in batches, each with one or more samplers
+SAMPLED_PARAMETERS = ["seats", "turn_times", "weeklyfreq_a",
+                      "seat_load_factor", "start_end_weeks", "weeklyfreq_b",
+                      "daily_demand"]
 
+# Requested times are sampled in 5-minute intervals of a day, so the curves
+# of daily_demand must have a number of entries dividing this one
+NUM_TIME_INTERVALS = 24 * 60 // 5
 
-def sample_par_from_list(probs, size=1, replace=False):
+
+def sample_par_from_list(probs, rng, size=1, replace=False):
     """
         Take a parameter or multiple parameters, with or without replacement,
         at random from a list of possible options
@@ -18,13 +26,13 @@ def sample_par_from_list(probs, size=1, replace=False):
     idx = np.arange(len(probs))
 
     # Ensure probabilities add up to 1
-    probs = np.array(probs)
+    probs = np.array(probs, dtype=float)
     probs /= probs.sum()
 
-    return np.random.choice(idx, size=size, p=probs, replace=replace)
+    return rng.choice(idx, size=size, p=probs, replace=replace)
 
 
-def sample_par_from_dict(dict_, size=1, replace=False):
+def sample_par_from_dict(dict_, rng, size=1, replace=False):
     """
         Take a parameter or multiple parameters, with or without replacement,
         at random from a dictionary of possible options
@@ -37,59 +45,59 @@ def sample_par_from_dict(dict_, size=1, replace=False):
     choices = list(dict_.keys())
 
     # Chose size elements from the keys
-    return np.random.choice(choices, size=size, p=probs, replace=replace)
+    return rng.choice(choices, size=size, p=probs, replace=replace)
 
 
-def sample_num_days(parameters):
+def sample_num_days(parameters, rng):
     """
         Sample parameter indicating number of days in the schedule
     """
     profile = parameters["schedule_size"]
-    return np.random.randint(profile["min_days"], profile["max_days"])
+    return int(rng.integers(profile["min_days"], profile["max_days"]))
 
 
-def sample_dom_int_proportion(parameters):
+def sample_dom_int_proportion(parameters, rng):
     """
         Sample parameter indicating proportion of domestic/international flights
     """
     profile = parameters["dom_req"]
-    return np.random.uniform(profile["min_p"], profile["max_p"])
+    return rng.uniform(profile["min_p"], profile["max_p"])
 
 
-def sample_slf(parameters):
+def sample_slf(parameters, rng):
     """
         Sample profile with seat load factor distributions
     """
     profile = parameters["seat_load_factor"]
-    return sample_par_from_dict(profile)[0]
+    return sample_par_from_dict(profile, rng)[0]
 
 
-def sample_seats(parameters):
+def sample_seats(parameters, rng):
     """
         Sample number of seats in the flight from uniform distribution between
         limits specified in parameters["seats"]
     """
     profile = parameters["seats"]
-    seats = sample_par_from_dict(profile)[0]
+    seats = sample_par_from_dict(profile, rng)[0]
 
     return int(seats)
 
 
-def sample_flight_time(parameters, arr_dep):
+def sample_flight_time(parameters, arr_dep, rng):
     """
         Sample hour in 5-minute buckets
     """
 
     profile = parameters["daily_demand"]
-    assert 1440 % len(profile[arr_dep]) == 0
+    assert NUM_TIME_INTERVALS % len(profile[arr_dep]) == 0
 
-    interval_len = 288 / len(profile[arr_dep])
-    minutes = sample_par_from_list(profile[arr_dep])[0] * interval_len * 5
+    interval_len = NUM_TIME_INTERVALS // len(profile[arr_dep])
+    minutes = sample_par_from_list(profile[arr_dep], rng)[0] * interval_len * 5
 
-    minutes = minutes + np.random.randint(0, interval_len) * 5
+    minutes = minutes + rng.integers(0, interval_len) * 5
 
     # Correct if it goes to following day
-    assert minutes // (288 * 5) == 0
+    assert minutes // (NUM_TIME_INTERVALS * 5) == 0
 
     hour = int(minutes // 60)
     minute = int(minutes % 60)
@@ -100,30 +108,30 @@ def sample_flight_time(parameters, arr_dep):
     return hour, minute
 
 
-def sample_weekdays(parameters):
+def sample_weekdays(parameters, rng):
     """
         Sample frequency of request
     """
 
     # Generate number of weekdays
     profile = parameters["weeklyfreq_a"]
-    num_weekdays = sample_par_from_dict(profile)[0]
+    num_weekdays = sample_par_from_dict(profile, rng)[0]
 
     # Generate specific days of the week
     profile = parameters["weeklyfreq_b"]
-    weekdays = sample_par_from_dict(profile, size=num_weekdays)
+    weekdays = sample_par_from_dict(profile, rng, size=num_weekdays)
 
     return weekdays
 
 
-def sample_start_end_week(parameters, first_week):
+def sample_start_end_week(parameters, first_week, rng):
     """
         Sample first and last week of a request
     """
 
     # Generate number of weeks in the request
     profile = parameters["start_end_weeks"]
-    startend_str = sample_par_from_dict(profile)[0]
+    startend_str = sample_par_from_dict(profile, rng)[0]
 
     start, end = startend_str.split(",")
     rel_start = int(start) - first_week
@@ -135,58 +143,54 @@ def sample_start_end_week(parameters, first_week):
     return rel_start, rel_end
 
 
-def sample_total_demand(parameters):
+def sample_total_demand(parameters, rng):
     """
         Sample parameter indicating total number of ops in the schedule
     """
-    out = 1000 * np.random.randint(
+    out = 1000 * int(rng.integers(
         parameters["season_demand"]["min_k"],
-        parameters["season_demand"]["max_k"])
+        parameters["season_demand"]["max_k"]))
 
     return out
 
 
-def is_flight_linked(parameters):
+def is_flight_linked(parameters, rng):
     """
         Sample parameter indicating whether a request is linked
     """
     profile = parameters["proportion_linked"]
-    return np.random.binomial(1, profile) * .5
+    return rng.binomial(1, profile) * .5
 
 
-def is_flight_domestic(parameters):
+def is_flight_domestic(parameters, rng):
     """
         Sample parameter indicating whether a request is domestic
     """
     profile = parameters["dom_req"]
-    return np.random.binomial(1, profile)
+    return rng.binomial(1, profile)
 
 
-def generate_turn_time(flight, parameters):
+def generate_turn_time(flight, parameters, rng):
     """
         Sample parameter indicating turnaround time requested
     """
     profile = parameters["turn_times"]
-    ground_time = sample_par_from_dict(profile)[0]
+    ground_time = sample_par_from_dict(profile, rng)[0]
 
     if flight["ArrDep"] == "D":
         ground_time *= -1
-    linked_time_str = utils_times.add_minutes_to_time(
-        flight["Req"], ground_time)
-
-    linked_hour, _ = utils_times.str_to_time(linked_time_str)
-    init_hour, _ = utils_times.str_to_time(flight["Req"])
 
-    if flight["ArrDep"] == "D" and linked_hour > init_hour:
-        return None
+    hour, minute = utils_times.str_to_time(flight["Req"])
+    linked_minutes = hour * 60 + minute + ground_time
 
-    if flight["ArrDep"] == "A" and linked_hour < init_hour:
+    # Turnaround flight must be on the same day
+    if not 0 <= linked_minutes < 24 * 60:
         return None
 
-    return linked_time_str
+    return utils_times.time_to_str(linked_minutes // 60, linked_minutes % 60)
 
 
-def choose_profiles(parameters):
+def choose_profiles(parameters, rng):
     """
         Choose one option from all options available for each parameter
         required to generate data
@@ -195,23 +199,302 @@ def choose_profiles(parameters):
     filtered_params = dict()
     non_profile_fields = [
         "schedule_size", "season_demand", "seat_load_factor",
-        "capacity_ratios", "dom_req"
+        "capacity_ratios", "dom_req", "samplers"
     ]
 
     for key, value in parameters.items():
         if key not in non_profile_fields:
-            instance_profiles[key] = np.random.choice(list(value.keys()))
+            instance_profiles[key] = rng.choice(list(value.keys()))
             filtered_params[key] = parameters[key][instance_profiles[key]]
         else:
             filtered_params[key] = parameters[key]
 
-    filtered_params["dom_req"] = sample_dom_int_proportion(parameters)
+    filtered_params["dom_req"] = sample_dom_int_proportion(parameters, rng)
+
+    # Record the names of the chosen options
+    filtered_params["profiles"] = {
+        key: str(value) for key, value in instance_profiles.items()}
+
+    # Samplers compiled in advance for the chosen options, if any
+    if "samplers" in parameters:
+        filtered_params["samplers"] = select_samplers(
+            parameters["samplers"], instance_profiles)
 
     return filtered_params
 
 
-def sample_terminal(parameters):
+def sample_terminal(parameters, rng):
     """
         Sample terminal number
     """
-    return np.random.choice(parameters["Terminals"])
+    return rng.choice(parameters["Terminals"])
+
+
+class AliasSampler:
+    """
+        Sampler of a discrete distribution using Walker's alias method. The
+        tables are built once, after which drawing any number of values takes
+        a fixed number of array operations. values can have extra dimensions
+        after the first one (one row per option)
+    """
+
+    def __init__(self, values, probs):
+        probs = np.asarray(probs, dtype=float)
+        assert probs.ndim == 1 and len(probs) > 0
+        assert np.all(probs >= 0) and probs.sum() > 0
+
+        self.values = np.asarray(values)
+        self.probs = probs / probs.sum()
+        assert len(self.values) == len(self.probs)
+
+        # Split the scaled probabilities into columns of height one, each
+        # holding its own option up to accept and the alias option above it
+        num_options = len(self.probs)
+        scaled = self.probs * num_options
+        self.accept = np.ones(num_options)
+        self.alias = np.arange(num_options)
+
+        small = [idx for idx in range(num_options) if scaled[idx] < 1]
+        large = [idx for idx in range(num_options) if scaled[idx] >= 1]
+
+        while small and large:
+            idx_small, idx_large = small.pop(), large.pop()
+            self.accept[idx_small] = scaled[idx_small]
+            self.alias[idx_small] = idx_large
+
+            scaled[idx_large] -= 1 - scaled[idx_small]
+            if scaled[idx_large] < 1:
+                small.append(idx_large)
+            else:
+                large.append(idx_large)
+
+    @classmethod
+    def from_dict(cls, dict_, dtype=None):
+        """
+            Sampler of the keys of a dictionary of options, with their values
+            as probabilities
+        """
+        return cls(np.array(list(dict_.keys()), dtype=dtype),
+                   list(dict_.values()))
+
+    def __len__(self):
+        return len(self.probs)
+
+    def draw_idx(self, size, rng):
+        """
+            Draw the indices of size options, with replacement
+        """
+        idx = rng.integers(len(self.probs), size=size)
+        is_accepted = rng.random(size) < self.accept[idx]
+
+        return np.where(is_accepted, idx, self.alias[idx])
+
+    def draw(self, size, rng):
+        """
+            Draw size values, with replacement
+        """
+        return self.values[self.draw_idx(size, rng)]
+
+
+def compile_samplers(parameters, first_week=None, end_day=None):
+    """
+        Build samplers for the distributions of an instance, i.e. parameters
+        as returned by choose_profiles, reusing the samplers compiled in
+        advance if they are in parameters. If end_day is given, start/end
+        weeks are conditioned on starting in a week (counted from first_week)
+        that begins on or before that day
+    """
+    samplers = dict()
+
+    if "samplers" in parameters:
+        samplers.update(parameters["samplers"])
+    else:
+        for name in SAMPLED_PARAMETERS:
+            samplers.update(compile_profile_samplers(name, parameters[name]))
+
+    if end_day is not None:
+        weeks, probs = get_start_end_weeks(parameters["start_end_weeks"])
+        is_valid = (weeks[:, 0] - first_week) * 7 <= end_day
+        assert np.any(probs[is_valid] > 0)
+        samplers["start_end_weeks"] = AliasSampler(
+            weeks[is_valid], probs[is_valid])
+
+    return samplers
+
+
+def compile_profile_samplers(name, profile):
+    """
+        Samplers of one option of a parameter in SAMPLED_PARAMETERS, as a
+        dictionary by sampler name. Values are converted to their types once:
+        ints for seats, turnaround times and number of weekdays, floats for
+        seat load factors, (start, end) week pairs and weekday (Monday first)
+        or 5-minute interval indices
+    """
+    if name in ["seats", "turn_times", "weeklyfreq_a"]:
+        return {name: AliasSampler.from_dict(profile, dtype=int)}
+
+    if name == "seat_load_factor":
+        return {name: AliasSampler.from_dict(profile, dtype=float)}
+
+    if name == "start_end_weeks":
+        return {name: AliasSampler(*get_start_end_weeks(profile))}
+
+    if name == "weeklyfreq_b":
+        day_names = sorted(profile,
+                           key=utils_dates.weekname_to_num_mon_1_sun_7)
+        return {name: AliasSampler(
+            np.arange(7), [profile[d] for d in day_names])}
+
+    assert name == "daily_demand"
+    samplers = dict()
+    for flag in ("A", "D"):
+        probs = profile[flag]
+        assert NUM_TIME_INTERVALS % len(probs) == 0
+        samplers["daily_demand_" + flag] = AliasSampler(
+            np.arange(len(probs)), probs)
+
+    return samplers
+
+
+def get_start_end_weeks(profile):
+    """
+        (options x 2) array of start and end weeks of a start_end_weeks
+        profile, from its "start, end" keys, and their probabilities
+    """
+    weeks = np.array([s.split(",") for s in profile], dtype=int)
+    probs = np.array(list(profile.values()), dtype=float)
+
+    return weeks, probs
+
+
+def select_samplers(samplers, profiles):
+    """
+        Samplers of the chosen option of each parameter, from samplers
+        compiled for every option (see utils_params.compile_parameters)
+    """
+    selected = dict()
+    for name, options in samplers.items():
+        selected.update(options[profiles[name]] if name in profiles
+                        else options)
+
+    return selected
+
+
+def sample_weekday_masks(samplers, size, rng):
+    """
+        Sample frequencies of size requests as a (size x 7) boolean array of
+        operating weekdays, Monday first
+    """
+    # Generate number of weekdays
+    num_weekdays = samplers["weeklyfreq_a"].draw(size, rng)
+
+    # Generate specific days of the week without replacement: ranking
+    # exponential keys scaled by the probabilities is equivalent to drawing
+    # the weekdays one after another. Weekdays with probability zero are
+    # never drawn, as in sample_weekdays
+    probs = samplers["weeklyfreq_b"].probs
+    is_possible = probs > 0
+    if size and num_weekdays.max() > is_possible.sum():
+        raise ValueError("Fewer weekdays with non-zero probability than "
+                         "weekdays to draw")
+
+    keys = np.full((size, 7), np.inf)
+    np.divide(rng.exponential(size=(size, 7)), probs, out=keys,
+              where=is_possible)
+    ranks = keys.argsort(axis=1).argsort(axis=1)
+
+    return (ranks < num_weekdays[:, None]) & is_possible
+
+
+def sample_start_end_week_batch(samplers, first_week, size, rng):
+    """
+        Sample first and last week of size requests
+    """
+    weeks = samplers["start_end_weeks"].draw(size, rng)
+    rel_start = weeks[:, 0] - first_week
+    rel_end = weeks[:, 1] - first_week
+
+    assert np.all(rel_start >= 0)
+    assert np.all(rel_end >= rel_start)
+
+    return rel_start, rel_end
+
+
+def sample_flight_minutes_batch(samplers, arr_dep, rng):
+    """
+        Sample requested time in minutes after midnight (5-minute buckets)
+        for an array of arrival/departure flags
+    """
+    minutes = np.zeros(len(arr_dep), dtype=int)
+
+    for flag in ("A", "D"):
+        sampler = samplers["daily_demand_" + flag]
+        interval_len = NUM_TIME_INTERVALS // len(sampler)
+
+        is_flag = arr_dep == flag
+        intervals = sampler.draw(is_flag.sum(), rng)
+
+        minutes[is_flag] = (intervals * interval_len + rng.integers(
+            0, interval_len, size=is_flag.sum())) * 5
+
+    assert np.all(minutes < NUM_TIME_INTERVALS * 5)
+
+    return minutes
+
+
+def sample_series_batch(parameters, samplers, size, first_week, num_weeks,
+                        rng):
+    """
+        Sample size requests at once, drawing from the samplers built by
+        compile_samplers. Returns a dictionary of arrays with weekday masks,
+        start/end dates as day offsets from the start of the season, seats,
+        passengers, arrival/departure, requested minute, terminal,
+        domestic/international flag and requested minute of the turnaround
+        flight (-1 if none)
+    """
+    batch = dict()
+
+    batch["weekday_masks"] = sample_weekday_masks(samplers, size, rng)
+
+    start_week, end_week = sample_start_end_week_batch(
+        samplers, first_week, size, rng)
+    batch["start_days"], batch["end_days"] = utils_dates.week_limits_to_days(
+        start_week, end_week, batch["weekday_masks"], num_weeks)
+
+    batch["seats"] = samplers["seats"].draw(size, rng)
+    slf = samplers["seat_load_factor"].draw(size, rng)
+    batch["pax"] = (batch["seats"] * slf).astype(int)
+
+    batch["arr_dep"] = rng.choice(["A", "D"], size=size)
+    batch["minutes"] = sample_flight_minutes_batch(
+        samplers, batch["arr_dep"], rng)
+
+    batch["term"] = rng.choice(parameters["Terminals"], size=size)
+    batch["is_dom"] = rng.binomial(
+        1, parameters["dom_req"], size=size).astype(bool)
+    batch["turn_minutes"] = sample_turn_minutes_batch(
+        parameters, samplers, batch["arr_dep"], batch["minutes"], rng)
+
+    return batch
+
+
+def sample_turn_minutes_batch(parameters, samplers, arr_dep, minutes, rng):
+    """
+        Choose which of a batch of requests are linked and sample the
+        requested time of their turnaround flights, in minutes after midnight.
+        Returns -1 for requests that are not linked or whose turnaround flight
+        would be on a different day
+    """
+    is_linked = rng.binomial(
+        1, parameters["proportion_linked"], size=len(minutes)).astype(bool)
+
+    ground_times = samplers["turn_times"].draw(is_linked.sum(), rng)
+    ground_times = np.where(arr_dep[is_linked] == "D", -1, 1) * ground_times
+
+    turn_minutes = np.full(len(minutes), -1)
+    turn_minutes[is_linked] = minutes[is_linked] + ground_times
+
+    # Turnaround flight must be on the same day
+    turn_minutes[(turn_minutes < 0) | (turn_minutes >= 24 * 60)] = -1
+
+    return turn_minutes
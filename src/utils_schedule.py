@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+"""
+This script contains a columnar container for schedules built by generate.py
+"""
+
+import numpy as np
+import utils_dates
+
+
+# All 128 frequency strings, indexed by their weekday bitmask (Monday = 1)
+FREQ_STRS = utils_dates.weekday_masks_to_freq_strs(
+    (np.arange(128)[:, None] >> np.arange(7)) & 1)
+
+# Fields of a schedule, in the order they are exported. Categorical fields
+# are stored as fixed-width codes into the list of categories of the field
+FIELDS = {
+    "FREQ": "category",
+    "Carrier": "category",
+    "Airport": "category",
+    "Season": "category",
+    "ServType": "category",
+    "Term": "category",
+    "OrigDest": "category",
+    "StartDate": np.int16,
+    "EndDate": np.int16,
+    "Seats": np.int32,
+    "Pax": np.int32,
+    "ArrDep": "category",
+    "Req": np.int16,
+    "NoOps": np.int32,
+    "TurnCarrier": "category",
+    "TurnFlNum": np.int32,
+    "FlNum": np.int32,
+}
+
+CODE_DTYPE = np.int8
+
+
+class Schedule:
+    """
+        Schedule stored as one typed numpy array per field. Dates are day
+        offsets from the start of the season, Req is an int in HHMM format,
+        flight numbers are ints (-1 if missing) and categorical fields hold
+        codes (-1 if missing). Arrays grow as rows are added
+    """
+
+    def __init__(self, terminals, size=0):
+        self.categories = {
+            "FREQ": list(FREQ_STRS),
+            "Carrier": ["ZZ"],
+            "Airport": ["ZZ2"],
+            "Season": ["S20"],
+            "ServType": ["J"],
+            "Term": list(terminals),
+            "OrigDest": ["ZZD", "ZZI"],
+            "ArrDep": ["A", "D"],
+        }
+        # Codes of carriers and turnaround carriers are interchangeable
+        self.categories["TurnCarrier"] = self.categories["Carrier"]
+
+        self.codes = {
+            name: {value: code for code, value in enumerate(values)}
+            for name, values in self.categories.items()}
+
+        self.size = 0
+        self.data = {name: np.zeros(0, dtype=self.dtype(name))
+                     for name in FIELDS}
+        self.reserve(size)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, name):
+        """
+            View of the values of a field (codes for categorical fields)
+        """
+        return self.data[name][:self.size]
+
+    def dtype(self, name):
+        """
+            Type of the array storing a field
+        """
+        if FIELDS[name] == "category":
+            return CODE_DTYPE
+
+        return FIELDS[name]
+
+    def reserve(self, size):
+        """
+            Make room for at least size rows, doubling the capacity if needed
+        """
+        capacity = len(self.data["FlNum"])
+        if size <= capacity:
+            return
+
+        capacity = max(size, 2 * capacity)
+        for name, values in self.data.items():
+            grown = np.zeros(capacity, dtype=values.dtype)
+            grown[:self.size] = values[:self.size]
+            self.data[name] = grown
+
+    def encode(self, name, values):
+        """
+            Codes of an array of values of a categorical field, with "" mapped
+            to -1 (missing)
+        """
+        uniq_values, inverse = np.unique(
+            np.asarray(values).astype(str), return_inverse=True)
+        uniq_codes = np.array(
+            [-1 if value == "" else self.codes[name][value]
+             for value in uniq_values], dtype=CODE_DTYPE)
+
+        return uniq_codes[inverse.ravel()]
+
+    def decode(self, name, codes):
+        """
+            Values of a categorical field for a code or an array of codes,
+            with -1 (missing) mapped to ""
+        """
+        return np.array(self.categories[name] + [""])[codes]
+
+    def append(self, flight):
+        """
+            Add a row from a dictionary with one (decoded) value per field,
+            e.g. as created by generate.generate_single_request. Returns the
+            index of the new row
+        """
+        idx = self.size
+        self.reserve(idx + 1)
+        self.size += 1
+
+        for name, value in flight.items():
+            if FIELDS[name] == "category":
+                value = -1 if value == "" else self.codes[name][value]
+            elif isinstance(value, str):
+                value = -1 if value == "" else int(value)
+
+            self.data[name][idx] = value
+
+        return idx
+
+    def append_copy(self, idx):
+        """
+            Add a copy of row idx. Returns the index of the new row
+        """
+        new_idx = self.size
+        self.reserve(new_idx + 1)
+        self.size += 1
+
+        for values in self.data.values():
+            values[new_idx] = values[idx]
+
+        return new_idx
+
+    def extend(self, columns):
+        """
+            Add rows from a dictionary of arrays with one element per row,
+            holding codes for categorical fields
+        """
+        size = len(columns["FlNum"])
+        self.reserve(self.size + size)
+
+        for name, values in columns.items():
+            self.data[name][self.size:self.size + size] = values
+
+        self.size += size
+
+    def take(self, rows):
+        """
+            New schedule with the selected rows (indices or boolean mask)
+        """
+        schedule = Schedule(self.categories["Term"])
+        schedule.data = {name: self[name][rows] for name in FIELDS}
+        schedule.size = len(schedule.data["FlNum"])
+
+        return schedule
+
+    def weekday_masks(self):
+        """
+            (series x 7) boolean array of operating weekdays, Monday first
+        """
+        return ((self["FREQ"][:, None] >> np.arange(7)) & 1).astype(bool)
+
+    def to_dataframe(self):
+        """
+            DataFrame with typed columns (categoricals for categorical fields)
+            built on views of the arrays of the schedule
+        """
+        import pandas as pd
+
+        columns = dict()
+        for name in FIELDS:
+            if FIELDS[name] == "category":
+                columns[name] = pd.Categorical.from_codes(
+                    self[name], self.categories[name])
+            else:
+                columns[name] = self[name]
+
+        return pd.DataFrame(columns, copy=False)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+"""
+This script contains functions computing summary demand distributions of a
+schedule, as plotted in the reports created by visualise.py
+"""
+
+import numpy as np
+import utils_dates
+import utils_flights
+
+
+# Bins of the turnaround time distribution, in minutes
+TURN_TIME_BINS = np.arange(200)[::5]
+
+# Percentiles across days of the demand bands drawn for each time window
+BAND_PERCENTILES = [0, 50, 90, 99, 100]
+
+
+def get_num_weeks_distr(dem_df):
+    """
+        Number of requests spanning each number of weeks
+    """
+    start_week = utils_dates.day_to_week(dem_df["StartDate"].values)
+    end_week = utils_dates.day_to_week(dem_df["EndDate"].values)
+
+    num_weeks = end_week - start_week
+    bins = np.arange(0, np.max(num_weeks) + 1)
+
+    num_weeks_distr, _ = np.histogram(num_weeks, bins=bins)
+
+    return num_weeks_distr
+
+
+def get_weekday_masks(dem_df):
+    """
+        (series x 7) boolean array of operating weekdays, Monday first
+    """
+    return utils_dates.freqs_to_weekday_masks(dem_df["FREQ"].values)
+
+
+def get_seasonal_profile(dem_df, weekday_masks=None):
+    """
+        Number of flights in each day of the season, from the first date of
+        the schedule
+    """
+    if weekday_masks is None:
+        weekday_masks = get_weekday_masks(dem_df)
+
+    first_day, last_day = utils_dates.get_first_last_dates(dem_df)
+    num_days = last_day - first_day + 1
+    start_offsets = dem_df["StartDate"].values - first_day
+    end_offsets = dem_df["EndDate"].values - first_day
+
+    # Series operating on each weekday, counted with difference arrays
+    weekdays, series = np.nonzero(weekday_masks.T)
+    changes = np.zeros((7, num_days + 1), dtype=int)
+    np.add.at(changes, (weekdays, start_offsets[series]), 1)
+    np.add.at(changes, (weekdays, end_offsets[series] + 1), -1)
+    active = np.cumsum(changes[:, :-1], axis=1)
+
+    days = np.arange(num_days)
+    return active[utils_dates.day_to_weekday(first_day + days), days]
+
+
+def get_num_weekdays_distr(dem_df, weekday_masks=None):
+    """
+        Number of requests operating on 1, 2, ..., 7 days of the week
+    """
+    if weekday_masks is None:
+        weekday_masks = get_weekday_masks(dem_df)
+
+    return np.bincount(weekday_masks.sum(axis=1), minlength=8)[1:]
+
+
+def get_weekday_counts(dem_df, weekday_masks=None):
+    """
+        Number of requests operating on each day of the week, Monday first
+    """
+    if weekday_masks is None:
+        weekday_masks = get_weekday_masks(dem_df)
+
+    return weekday_masks.sum(axis=0)
+
+
+def get_seats_pax_distr(dem_df):
+    """
+        Number of requests in each bucket of 5 seats and 5 passengers.
+        Returns the buckets (lower limits) and both distributions
+    """
+    bins = np.arange(0, int(np.max(dem_df["Seats"]) + 5))[::5]
+    seats_5buckets, _ = np.histogram(dem_df["Seats"], bins=bins)
+    pax_5buckets, _ = np.histogram(dem_df["Pax"], bins=bins)
+
+    return bins[:-1], seats_5buckets, pax_5buckets
+
+
+def get_dom_int_split(dem_df):
+    """
+        Number of domestic and international requests
+    """
+    is_dom = np.isin(dem_df["OrigDest"].values.astype(str),
+                     utils_flights.dom_airports)
+
+    dom_req = is_dom.sum()
+    int_req = len(dem_df) - dom_req
+
+    return np.array([dom_req, int_req])
+
+
+def get_linked_split(dem_df):
+    """
+        Number of linked and not linked requests
+    """
+    is_linked = dem_df["TurnCarrier"].values.astype(str) != ""
+
+    linked = is_linked.sum()
+    not_linked = len(dem_df) - linked
+
+    return np.array([linked, not_linked])
+
+
+def get_turn_time_distr(dem_df):
+    """
+        Number of linked arrivals in each bucket of turnaround times (see
+        TURN_TIME_BINS)
+    """
+    arr_idx, dep_idx = utils_flights.get_turnaround_pairs(dem_df)
+    req_minutes = utils_flights.get_req_minutes(dem_df)
+
+    turn_times = req_minutes[dep_idx] - req_minutes[arr_idx]
+
+    yvals, _ = np.histogram(turn_times, bins=TURN_TIME_BINS)
+
+    return yvals
+
+
+def get_summary_stats(dem_df):
+    """
+        All summary demand distributions of a schedule, as a dictionary of
+        arrays. Frequencies are parsed once for all of them
+    """
+    weekday_masks = get_weekday_masks(dem_df)
+    seats_pax_bins, seats_distr, pax_distr = get_seats_pax_distr(dem_df)
+
+    return {
+        "num_weeks": get_num_weeks_distr(dem_df),
+        "seasonal_profile": get_seasonal_profile(dem_df, weekday_masks),
+        "num_weekdays": get_num_weekdays_distr(dem_df, weekday_masks),
+        "weekdays": get_weekday_counts(dem_df, weekday_masks),
+        "seats_pax_bins": seats_pax_bins,
+        "seats": seats_distr,
+        "pax": pax_distr,
+        "dom_int": get_dom_int_split(dem_df),
+        "linked": get_linked_split(dem_df),
+        "turn_times": get_turn_time_distr(dem_df),
+    }
+
+
+def get_demand_bands(demand, cap_lims, percentiles=BAND_PERCENTILES):
+    """
+        Percentiles across days of the demand in each time window, from a
+        demand tensor (see utils_flights.get_demand_tensor). Returns one
+        (percentiles x time windows) array per capacity constraint
+    """
+    return [np.percentile(demand[c_idx, :, :cap_lim["Count"]], percentiles,
+                          axis=0)
+            for c_idx, cap_lim in enumerate(cap_lims)]
@@ -12,6 +12,13 @@ def time_to_str(hour, minute):
     return str(hour).zfill(2) + str(minute).zfill(2)
 
 
+def minutes_to_hhmm(minutes):
+    """
+        Converts minutes after midnight (int or array) to ints in HHMM format
+    """
+    return minutes // 60 * 100 + minutes % 60
+
+
 def add_minutes_to_time(time_str, delta_minutes):
     """
         Offsets a time in string format by amount given by int delta_minutes
@@ -5,20 +5,30 @@ capacity and demand folders and presenting various distributions of demand
 and capacity related parameters
 """
 
+import argparse
+import multiprocessing
 import os
-import collections
-import pandas as pd
+import sys
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_pdf import PdfPages
-from matplotlib import rc
 import utils_flights
 import utils_dates
 import utils_cap
+import utils_files
+import utils_profile
+import utils_stats
 import utils_times
 
-font = {'size': 8}
-rc('font', **font)
+# Number of reports a worker process renders before it is replaced
+MAX_TASKS_PER_WORKER = 10
+
+# Reports, their manifest and cached intermediate results of each instance
+REPORTS_DIR = os.path.join("schedules", "reports")
+MANIFEST_FILE = "manifest.yml"
+CACHE_DIR = os.path.join(REPORTS_DIR, "cache")
+
+# Modules computing the intermediate results cached for each report
+DATA_MODULES = [utils_cap, utils_dates, utils_files, utils_flights,
+                utils_stats, utils_times]
 
 
 def main():
@@ -26,49 +36,205 @@ def main():
         Main function that takes all generated instances and creates a report
         exploring different demand/capacity distributions for each one
     """
-    dirpath = os.path.join(os.getcwd(), "schedules", "demand")
-    dem_filenames = [f for f in os.listdir(dirpath) if is_file(f, dirpath)]
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_arguments(parser)
+    run(parser.parse_args())
+
+
+def add_arguments(parser):
+    """
+        Add the arguments of this script to an argparse parser
+    """
+    parser.add_argument("instances", nargs="*",
+                        help="IDs of the instances to report on, e.g. I0003 "
+                             "or 3 (all instances by default)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes rendering reports")
+    parser.add_argument("--demand-curves", default="bands",
+                        choices=["bands", "lines"],
+                        help="draw demand as percentile bands across days, "
+                             "or as one line per day")
+    parser.add_argument("--force", action="store_true",
+                        help="render reports even if their inputs have not "
+                             "changed since they were last rendered")
+    parser.add_argument("--profile", type=int, nargs="?", const=1, default=0,
+                        metavar="K",
+                        help="profile the first K reports rendered (1 if K "
+                             "is not given), writing pstats and collapsed "
+                             f"stacks to {utils_profile.PROFILES_DIR}")
+
+
+def run(args):
+    """
+        Create the reports requested by the parsed arguments
+    """
+    dem_filenames, missing = utils_files.select_demand_files(args.instances)
+    if missing:
+        sys.exit("no demand file for instances " + ", ".join(missing))
+
+    is_exist = os.path.exists(REPORTS_DIR)
+    if not is_exist:
+        # Create a new directory because it does not exist
+        os.makedirs(REPORTS_DIR)
+        print(f"New directory {REPORTS_DIR} created")
+
+    # Skip reports rendered from the same inputs by the same code
+    manifest_path = os.path.join(REPORTS_DIR, MANIFEST_FILE)
+    manifest = utils_files.read_yaml(manifest_path, default=dict())
+    data_version, report_version = get_code_versions()
+
+    num_reports = len(dem_filenames)
+    num_done = 0
+    tasks = []
 
     for dem_file in dem_filenames:
-        print(dem_file)
+        instance = utils_files.get_instance(dem_file)
+        entry = {"inputs": hash_inputs(dem_file), "code": report_version,
+                 "demand_curves": args.demand_curves}
+        pdf_path = os.path.join(REPORTS_DIR, instance + "_report.pdf")
+
+        if (not args.force and manifest.get(instance) == entry and
+                os.path.exists(pdf_path)):
+            num_done += 1
+            print(f"[{num_done}/{num_reports}] {instance}_report.pdf "
+                  "(unchanged)")
+        else:
+            tasks.append((dem_file, entry, data_version,
+                          len(tasks) < args.profile))
+
+    if args.workers > 1:
+        # Replace workers regularly so memory held by matplotlib is released
+        with multiprocessing.Pool(
+                args.workers, maxtasksperchild=MAX_TASKS_PER_WORKER) as pool:
+            reports = pool.imap_unordered(create_report_from_task, tasks)
+            for instance, entry in reports:
+                num_done += 1
+                print(f"[{num_done}/{num_reports}] {instance}_report.pdf")
+
+                manifest[instance] = entry
+                utils_files.write_yaml(manifest, manifest_path)
+    else:
+        for task in tasks:
+            instance, entry = create_report_from_task(task)
+            num_done += 1
+            print(f"[{num_done}/{num_reports}] {instance}_report.pdf")
+
+            manifest[instance] = entry
+            utils_files.write_yaml(manifest, manifest_path)
+
+
+def hash_inputs(dem_file):
+    """
+        Content hash of the demand and capacity files of an instance
+    """
+    return utils_files.hash_files(utils_files.get_input_paths(dem_file))
+
+
+def get_code_versions():
+    """
+        Content hashes of the code computing the intermediate results of a
+        report, and of all the code involved in rendering a report
+    """
+    data_files = [module.__file__ for module in DATA_MODULES]
+
+    return (utils_files.hash_files(data_files),
+            utils_files.hash_files(data_files + [__file__]))
+
+
+def create_report_from_task(task):
+    """
+        Create the report of a (demand file, manifest entry, data code
+        version, profile) task, profiling it if profile is True. Returns the
+        instance ID and its manifest entry
+    """
+    dem_file, entry, data_version, profile = task
+    args = (dem_file, entry["inputs"] + data_version, entry["demand_curves"])
+
+    if profile:
+        name = utils_files.get_instance(dem_file) + "_report"
+        utils_profile.profile_call(name, create_report, *args)
+    else:
+        create_report(*args)
 
-        cap_file = dem_file[:-10] + "capacity.csv"
+    return utils_files.get_instance(dem_file), entry
 
-        dem_df = pd.read_csv(os.path.join("schedules", "demand", dem_file))
-        cap_df = pd.read_csv(os.path.join("schedules", "capacity", cap_file))
 
-        dem_df = dem_df.replace(np.nan, '', regex=True)
+def create_report(dem_file, cache_key=None, demand_curves="bands"):
+    """
+        Create the PDF report of the instance of a demand file. Intermediate
+        results are cached under cache_key, if given
+    """
+    instance = utils_files.get_instance(dem_file)
+    dem_path, cap_path = utils_files.get_input_paths(dem_file)
 
-        cap_lims = utils_cap.df_to_cap_lims(cap_df)
+    cap_df, _ = utils_files.read_table(cap_path)
+    cap_lims = utils_cap.df_to_cap_lims(cap_df)
 
-        demand = utils_flights.get_initial_demand(dem_df, cap_lims)
+    demand, _, stats = get_intermediates(
+        dem_path, cap_lims, instance, cache_key)
 
-        # For each capacity limit
-        pdf_file = dem_file[:-10] + "report.pdf"
-        pdf_dir = os.path.join('schedules', 'reports')
-        is_exist = os.path.exists(pdf_dir)
-        if not is_exist:
-            # Create a new directory because it does not exist
-            os.makedirs(pdf_dir)
-            print(f"New directory {pdf_dir} created")
+    import_pyplot()
+    from matplotlib.backends.backend_pdf import PdfPages
 
-        pdf_path = os.path.join(pdf_dir, pdf_file)
+    # For each capacity limit
+    pdf_path = os.path.join(REPORTS_DIR, instance + "_report.pdf")
 
-        with PdfPages(pdf_path) as pdf:
-            visualise_summary_stats(dem_df, pdf)
-            visualise_demand_vs_capacity(demand, cap_lims, pdf)
+    with PdfPages(pdf_path) as pdf:
+        visualise_summary_stats(stats, pdf)
+        visualise_demand_vs_capacity(demand, cap_lims, pdf, demand_curves)
 
 
-def is_file(filename, dir_):
+def get_intermediates(dem_path, cap_lims, instance, cache_key=None):
     """
-        Check whether an item in a directory is a file
+        Demand tensor (with its first day) and summary demand distributions of
+        an instance. If cache_key is given, they are loaded from the cache of
+        the instance when it was saved with the same key, and computed and
+        saved otherwise
     """
-    filepath = os.path.join(dir_, filename)
-    if not os.path.isfile(filepath):
-        return False
-    if "DS_Store" in filename:
-        return False
-    return True
+    cache_path = os.path.join(CACHE_DIR, instance + ".npz")
+
+    if cache_key is not None and os.path.exists(cache_path):
+        with np.load(cache_path) as cached:
+            if str(cached["key"]) == cache_key:
+                stats = {name[len("stat_"):]: cached[name]
+                         for name in cached.files if name.startswith("stat_")}
+                return cached["demand"], int(cached["first_day"]), stats
+
+    dem_df, _ = utils_files.read_schedule(dem_path)
+
+    window_lookups = utils_cap.get_window_lookups(cap_lims)
+    demand, first_day = utils_flights.get_demand_tensor(
+        dem_df, cap_lims, window_lookups)
+    stats = utils_stats.get_summary_stats(dem_df)
+
+    if cache_key is not None:
+        utils_files.mkdir_p(CACHE_DIR)
+
+        # Unique to this process, as two may cache the same instance
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as outfile:
+            np.savez_compressed(
+                outfile, key=cache_key, demand=demand, first_day=first_day,
+                **{"stat_" + name: values for name, values in stats.items()})
+        os.replace(tmp_path, cache_path)
+
+    return demand, first_day, stats
+
+
+def import_pyplot():
+    """
+        Import pyplot with the backend and font of the reports. Matplotlib is
+        slow to import, so this is only done when a report is rendered
+    """
+    import matplotlib
+
+    # Reports are only written to files, never shown
+    matplotlib.use("Agg")
+    matplotlib.rc("font", size=8)
+
+    import matplotlib.pyplot as plt
+
+    return plt
 
 
 def legend_without_duplicate_labels(axis):
@@ -82,31 +248,55 @@ def legend_without_duplicate_labels(axis):
     axis.legend(*zip(*unique))
 
 
-def visualise_demand_vs_capacity(demand, cap_lims, pdf):
+def visualise_demand_vs_capacity(demand, cap_lims, pdf, curves="bands"):
     """
-        Plot demand vs. capacity curves for each type of capacity constraint
+        Plot demand vs. capacity curves for each type of capacity constraint.
+        Demand is drawn as bands of percentiles across days if curves is
+        "bands", or as one line per day if it is "lines"
     """
+    plt = import_pyplot()
+    from matplotlib.collections import LineCollection
+
     xticks = [hour * 2 * 60 for hour in range(12)]
     xticklabels = [f"{hour * 2}h" for hour in range(12)]
 
     fig, axes = plt.subplots(len(cap_lims), 1, figsize=(8.27,
                              2 * len(cap_lims)), dpi=100)
 
+    if curves == "bands":
+        bands = utils_stats.get_demand_bands(demand, cap_lims)
+    else:
+        assert curves == "lines"
+
     for c_idx, cap_lim in enumerate(cap_lims):
         assert cap_lim["Resource"] == "P" or cap_lim["Resource"] == "M"
 
         res = "T" if cap_lim["Resource"] == "P" else "R"
-        frequency = cap_lim["Time"][1] - cap_lim["Time"][0]
-
-        # For each date
-        for _, yvals in demand[c_idx].items():
-            xvals = []
-            for time in cap_lim["Time"]:
-                assert time < 288 * 5
-                xvals.append(time)
-
-            axes[c_idx].plot(xvals, yvals, label="demand", linewidth=.75,
-                             color="royalblue", alpha=0.3)
+        frequency = cap_lim["Step"]
+
+        xvals = utils_cap.get_times(cap_lim)
+        assert np.all(xvals < 288 * 5)
+
+        if curves == "bands":
+            min_, p50, p90, p99, max_ = bands[c_idx]
+            axes[c_idx].fill_between(xvals, min_, max_, color="royalblue",
+                                     alpha=0.15, linewidth=0,
+                                     label="demand min-max")
+            axes[c_idx].fill_between(xvals, p50, p90, color="royalblue",
+                                     alpha=0.35, linewidth=0,
+                                     label="demand p50-p90")
+            axes[c_idx].plot(xvals, p99, color="royalblue", linewidth=.5,
+                             linestyle="--", label="demand p99")
+            axes[c_idx].plot(xvals, p50, color="royalblue", linewidth=.75,
+                             label="demand p50")
+        else:
+            # All days in a single artist
+            yvals = demand[c_idx, :, :cap_lim["Count"]]
+            segments = np.stack(np.broadcast_arrays(xvals, yvals), axis=-1)
+            axes[c_idx].add_collection(LineCollection(
+                segments, label="demand", linewidth=.75, color="royalblue",
+                alpha=0.3))
+            axes[c_idx].autoscale_view()
 
         axes[c_idx].set_title(c_idx, fontsize=8)
         axes[c_idx].set_xlabel("Time")
@@ -118,8 +308,8 @@ def visualise_demand_vs_capacity(demand, cap_lims, pdf):
             axes[c_idx].set_ylabel("Flights")
 
         # Plot capacity
-        axes[c_idx].axhline(y=np.mean(cap_lim["Limit"]), color='salmon',
-                            linestyle='-', label="capacity")
+        axes[c_idx].axhline(y=np.mean(utils_cap.get_limits(cap_lim)),
+                            color='salmon', linestyle='-', label="capacity")
 
         axes[c_idx].set_xticks(xticks)
         axes[c_idx].set_xticklabels(xticklabels)
@@ -145,81 +335,48 @@ def visualise_demand_vs_capacity(demand, cap_lims, pdf):
     return fig, axes
 
 
-def plot_num_weeks(dem_df, ax):
+def plot_num_weeks(stats, ax):
     """
         Plot histogram with distribution of number of weeks per request
     """
-    start_dates = pd.to_datetime(dem_df["StartDate"])
-    end_dates = pd.to_datetime(dem_df["EndDate"])
+    num_weeks_distr = stats["num_weeks"]
 
-    start_week = start_dates.apply(lambda x: int(x.strftime("%U"))).values
-    end_week = end_dates.apply(lambda x: int(x.strftime("%U"))).values
-
-    num_weeks = end_week - start_week
-    bins = np.arange(0, np.max(num_weeks) + 1)
-
-    num_weeks_distr, _ = np.histogram(num_weeks, bins=bins)
-    ax.bar(bins[:-1], num_weeks_distr, color="royalblue")
+    ax.bar(np.arange(len(num_weeks_distr)), num_weeks_distr,
+           color="royalblue")
     ax.set_title("Number of weeks per request")
     ax.set_xlabel("Number of weeks")
     ax.set_ylabel("Number of requests")
 
 
-def plot_seasonal_demand(dem_df, axis):
+def plot_seasonal_demand(stats, axis):
     """
         Plot line chart with number of flights in each day in the season
     """
-    seasonal_prof = {}
-
-    for _, flight_row in dem_df.iterrows():
-        dates = utils_dates.select_dates(flight_row)
-
-        for date in dates:
-            datekey = str(date.year) + \
-                      str(date.month).zfill(2) + str(date.day).zfill(2)
+    seasonal_prof = stats["seasonal_profile"]
 
-            if datekey not in seasonal_prof.keys():
-                seasonal_prof[datekey] = 1
-            else:
-                seasonal_prof[datekey] += 1
-
-    ordered_dict = collections.OrderedDict(sorted(seasonal_prof.items()))
-    axis.plot(ordered_dict.values(), color="royalblue")
+    axis.plot(seasonal_prof, color="royalblue")
     axis.set_title("Number of flights in each day of the season")
     axis.set_xlabel("Date")
-    axis.set_ylim([0, np.max(list(seasonal_prof.values())) * 1.1])
+    axis.set_ylim([0, np.max(seasonal_prof) * 1.1])
     axis.set_ylabel("Number of flights")
 
 
-def plot_number_of_weekdays(dem_df, axis):
+def plot_number_of_weekdays(stats, axis):
     """
         Plot histogram of number of week days in each series
     """
-    weekdays = dem_df["FREQ"].apply(
-        lambda x: len(utils_dates.freq_str_to_weekdays(x))).values
-
-    yvals, _ = np.histogram(weekdays, bins=np.arange(8) + 1)
-
     axis.set_title("Number of week days per request")
     axis.set_ylabel("Number of requests")
     axis.set_xlabel("Number of week days")
 
-    axis.bar(np.arange(7) + 1, yvals, color="royalblue")
+    axis.bar(np.arange(7) + 1, stats["num_weekdays"], color="royalblue")
 
 
-def plot_weekdays(dem_df, axis):
+def plot_weekdays(stats, axis):
     """
         Plot bar chart with number of requests including each day of the week
     """
-    weekdays = dem_df["FREQ"].apply(
-        lambda x: utils_dates.freq_str_to_weekdays(x)).values
-
-    counts = np.zeros(7)
-    for elem in weekdays:
-        for day in elem:
-            counts[day - 1] += 1
-
-    axis.bar(np.arange(7) + 1, counts, color="royalblue")
+    axis.bar(np.arange(7) + 1, stats["weekdays"], color="royalblue")
     axis.set_title("Number of requests in each week day")
     axis.set_xlabel("Day of week")
     axis.set_ylabel("Number of requests")
@@ -227,104 +384,70 @@ def plot_weekdays(dem_df, axis):
     axis.set_xticklabels(["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"])
 
 
-def plot_seats_and_pax(dem_df, axis):
+def plot_seats_and_pax(stats, axis):
     """
         Plot line charts with number of requests for each no. of seats/pax
     """
-    bins = np.arange(0, int(np.max(dem_df["Seats"]) + 5))[::5]
-    seats_5buckets, _ = np.histogram(dem_df["Seats"], bins=bins)
-    pax_5buckets, _ = np.histogram(dem_df["Pax"], bins=bins)
+    bins = stats["seats_pax_bins"]
 
-    axis.plot(bins[:-1], seats_5buckets, label="seats", color="royalblue")
-    axis.plot(bins[:-1], pax_5buckets, label="pax", color="salmon")
+    axis.plot(bins, stats["seats"], label="seats", color="royalblue")
+    axis.plot(bins, stats["pax"], label="pax", color="salmon")
     axis.legend()
     axis.set_title("Distribution of seats/pax per flight")
     axis.set_xlabel("Seats/Pax (5 seat buckets)")
     axis.set_ylabel("Number of requests")
 
 
-def plot_dom_int(dem_df, axis):
+def plot_dom_int(stats, axis):
     """
         Plot distribution of requests by dom/int split
     """
-    is_dom = dem_df["OrigDest"].apply(
-        lambda x: utils_flights.is_domestic(x)).values
-
-    dom_req = is_dom.sum()
-    int_req = len(dem_df) - dom_req
-
-    axis.bar([0, 1], [dom_req, int_req], color="royalblue")
+    axis.bar([0, 1], stats["dom_int"], color="royalblue")
     axis.set_xticks([0, 1])
     axis.set_xticklabels(["Domestic", "International"])
     axis.set_title("Domestic / International split")
     axis.set_ylabel("Number of requests")
 
 
-def plot_linked(dem_df, axis):
+def plot_linked(stats, axis):
     """
         Plot distribution of requests by linked/not linked split
     """
-    is_linked = dem_df["TurnCarrier"].apply(
-        lambda x: utils_flights.is_linked(x)).values
-
-    linked = is_linked.sum()
-    not_linked = len(dem_df) - linked
-
-    axis.bar([0, 1], [linked, not_linked], color="royalblue")
+    axis.bar([0, 1], stats["linked"], color="royalblue")
     axis.set_xticks([0, 1])
     axis.set_xticklabels(["Linked", "Not linked"])
     axis.set_title("Proportion of linked requests")
     axis.set_ylabel("Number of requests")
 
 
-def plot_turnaround_times(dem_df, axis):
+def plot_turnaround_times(stats, axis):
     """
         Plot histogram of turnaround time distributions
     """
-    linked_arr = dem_df[(dem_df['ArrDep'] == 'A') & (dem_df["TurnCarrier"] != "")]
-    linked_dep = dem_df[(dem_df['ArrDep'] == 'D') & (dem_df["TurnCarrier"] != "")]
-
-    turn_times = []
-    for _, arr in linked_arr.iterrows():
-        valid_deps = linked_dep[
-            (linked_dep['Carrier'] == arr['TurnCarrier']) &
-            (linked_dep['FlNum'] == arr['TurnFlNum']) &
-            (linked_dep['StartDate'] == arr['StartDate'])]
-
-        dep = valid_deps.iloc[0]
-
-        ahour, aminute = utils_times.str_to_time(arr["Req"])
-        arr_time = ahour * 60 + aminute
-
-        dhour, dminute = utils_times.str_to_time(dep["Req"])
-        dep_time = dhour * 60 + dminute
-
-        turn_times.append(dep_time - arr_time)
-
-    bins = np.arange(200)[::5]
-    yvals, _ = np.histogram(turn_times, bins=bins)
+    bins = utils_stats.TURN_TIME_BINS
 
-    axis.bar(bins[:-1], yvals, width=5, color="royalblue")
+    axis.bar(bins[:-1], stats["turn_times"], width=5, color="royalblue")
     axis.set_title("Turnaround times")
     axis.set_xlabel("Turnaround time")
     axis.set_ylabel("Number of requests")
 
 
-def visualise_summary_stats(dem_df, pdf):
+def visualise_summary_stats(stats, pdf):
     """
         Plot 8 graphs with different summary demand distributions
     """
+    plt = import_pyplot()
 
     _, axes = plt.subplots(4, 2, figsize=(8.27, 11.69), dpi=100)
 
-    plot_num_weeks(dem_df, axes[0, 0])
-    plot_seasonal_demand(dem_df, axes[0, 1])
-    plot_number_of_weekdays(dem_df, axes[1, 0])
-    plot_weekdays(dem_df, axes[1, 1])
-    plot_seats_and_pax(dem_df, axes[2, 0])
-    plot_dom_int(dem_df, axes[2, 1])
-    plot_linked(dem_df, axes[3, 0])
-    plot_turnaround_times(dem_df, axes[3, 1])
+    plot_num_weeks(stats, axes[0, 0])
+    plot_seasonal_demand(stats, axes[0, 1])
+    plot_number_of_weekdays(stats, axes[1, 0])
+    plot_weekdays(stats, axes[1, 1])
+    plot_seats_and_pax(stats, axes[2, 0])
+    plot_dom_int(stats, axes[2, 1])
+    plot_linked(stats, axes[3, 0])
+    plot_turnaround_times(stats, axes[3, 1])
 
     plt.suptitle("Demand distributions")
     plt.tight_layout()